@@ -1,26 +1,17 @@
-import sys
+import argparse
 import re
-from tqdm import tqdm
 from typing import Optional
-import bibtexparser
-import arxiv
-
-ARXIV_ID_PATTERN = re.compile(r"arXiv:\s*([\w.]+)", re.IGNORECASE)
-
-
-def extract_arxiv_id(entry: dict) -> Optional[str]:
-    arxiv_id = None
-    if "journal" in entry and "arxiv" in entry["journal"].lower():
-        match = ARXIV_ID_PATTERN.search(entry["journal"])
-        if match:
-            arxiv_id = match.group(1)
-
-    if "url" in entry and "arxiv.org" in entry["url"]:
-        match = re.search(r"\/(\d+\.\d+)", entry["url"])
-        if match:
-            arxiv_id = match.group(1)
-
-    return arxiv_id
+from bib_loader import iter_entries
+from arxiv_lookup import (
+    add_cache_arguments,
+    add_client_arguments,
+    fetch_papers,
+    open_cache,
+    open_client,
+)
+from arxiv_client import ArxivClient
+from identifiers import extract_arxiv_id
+from kvcache import Cache
 
 
 def comment_checker(comment):
@@ -51,36 +42,52 @@ def comment_checker(comment):
         return False
 
 
-def main(bibtex_file: str):
-    with open(bibtex_file, "r") as file:
-        bibtex_str = file.read()
-
-    bib_database = bibtexparser.loads(bibtex_str)
-    entries = bib_database.entries
-
-    for entry in tqdm(entries):
+def main(
+    bibtex_file: str,
+    cache: Optional[Cache] = None,
+    refresh: bool = False,
+    client: Optional[ArxivClient] = None,
+):
+    arxiv_ids = []
+    for entry, offset, line in iter_entries(bibtex_file):
         arxiv_id = extract_arxiv_id(entry)
         if arxiv_id:
-            search = arxiv.Search(id_list=[arxiv_id])
-            try:
-                paper = next(search.results())
-                if paper.doi or comment_checker(paper.comment):
-                    print(
-                        f"{paper.title} {paper.links[0].href}, {paper.comment}, doi: {paper.doi}"
-                    )
-                else:
-                    ...
-                    # print(
-                    #     f"{entry['title']} (arXiv ID: {arxiv_id}) has not been published elsewhere."
-                    # )
-            except StopIteration:
-                ...
-                # print(f"{entry['title']} (arXiv ID: {arxiv_id}) not found on arXiv")
+            arxiv_ids.append(arxiv_id)
+
+    papers = fetch_papers(
+        arxiv_ids,
+        cache=cache,
+        refresh=refresh,
+        client=client,
+    )
+
+    for arxiv_id in arxiv_ids:
+        paper = papers.get(arxiv_id)
+        if paper is None:
+            ...
+            # print(f"arXiv ID {arxiv_id} not found on arXiv")
+        elif paper.doi or comment_checker(paper.comment):
+            print(f"{paper.title} {paper.links[0]}, {paper.comment}, doi: {paper.doi}")
+        else:
+            ...
+            # print(
+            #     f"arXiv ID {arxiv_id} has not been published elsewhere."
+            # )
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python check_published.py bibtex_file")
-    else:
-        bibtex_file = sys.argv[1]
-        main(bibtex_file)
+    parser = argparse.ArgumentParser(
+        description="Search for arXiv papers that might have a published version"
+    )
+    parser.add_argument("bibtex_file", type=str, help="bibtex file to check")
+    add_cache_arguments(parser)
+    add_client_arguments(parser)
+    args = parser.parse_args()
+
+    with open_cache(args) as cache:
+        main(
+            args.bibtex_file,
+            cache=cache,
+            refresh=args.refresh,
+            client=open_client(args),
+        )
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import re
+import time
+import random
+import asyncio
+import warnings
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+USER_AGENT = "bib-boi (https://github.com/Wheest/bib-boi)"
+
+# arXiv asks for at most one request every three seconds, on one connection
+# https://info.arxiv.org/help/api/tou.html
+REQUEST_RATE = 1 / 3
+CONCURRENCY = 1
+MAX_RETRIES = 5
+BACKOFF_BASE = 3.0
+BACKOFF_CAP = 60.0
+TIMEOUT = 60.0
+
+# responses worth trying again, rather than errors in the query itself
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+VERSION_PATTERN = re.compile(r"v\d+$")
+NAMESPACES = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "arxiv": "http://arxiv.org/schemas/atom",
+}
+
+
+class Paper(NamedTuple):
+    arxiv_id: str  # without the version
+    version: Optional[str]
+    title: str
+    doi: Optional[str]
+    comment: Optional[str]
+    links: List[str]
+
+
+def strip_version(arxiv_id: str) -> str:
+    return VERSION_PATTERN.sub("", arxiv_id)
+
+
+class QueryError(Exception):
+    """arXiv rejected the query itself, e.g. for a malformed ID"""
+
+
+class TokenBucket:
+    """Lets through `rate` requests per second on average, in bursts of at
+    most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter, unless the server said how long"""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def parse_feed(feed: bytes) -> List[Paper]:
+    papers = []
+    for entry in ET.fromstring(feed).findall("atom:entry", NAMESPACES):
+        entry_id = entry.findtext("atom:id", "", NAMESPACES)
+        if "/abs/" not in entry_id:
+            continue  # arXiv reports errors as entries too
+        short_id = entry_id.split("/abs/")[-1]
+        version = VERSION_PATTERN.search(short_id)
+        papers.append(
+            Paper(
+                arxiv_id=strip_version(short_id),
+                version=version.group() if version else None,
+                title=" ".join(entry.findtext("atom:title", "", NAMESPACES).split()),
+                doi=entry.findtext("arxiv:doi", None, NAMESPACES),
+                comment=entry.findtext("arxiv:comment", None, NAMESPACES),
+                links=[
+                    link.get("href") for link in entry.findall("atom:link", NAMESPACES)
+                ],
+            )
+        )
+    return papers
+
+
+def get(url: str, timeout: float = TIMEOUT) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+class ArxivClient:
+    """Fetches arXiv metadata with bounded concurrency.
+
+    Every request, retries included, waits on a token bucket so the
+    sustained rate stays within arXiv's limits.
+    Transient failures are retried with exponential backoff and jitter.
+    `base_url` can point at a mirror, or a local stub server for testing.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ARXIV_API_URL,
+        rate: float = REQUEST_RATE,
+        concurrency: int = CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.base_url = base_url
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # asyncio primitives belong to one event loop, see `limits`
+        self.loop = None
+        self.bucket: Optional[TokenBucket] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    def limits(self) -> Tuple[TokenBucket, asyncio.Semaphore]:
+        """The rate and concurrency limits, made on first use in each loop"""
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.bucket = TokenBucket(self.rate)
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.bucket, self.semaphore
+
+    async def query(self, batch: List[str]) -> List[Paper]:
+        params = urllib.parse.urlencode(
+            {"id_list": ",".join(batch), "max_results": len(batch)}
+        )
+        url = f"{self.base_url}?{params}"
+        bucket, semaphore = self.limits()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    await bucket.acquire()
+                    feed = await asyncio.to_thread(get, url)
+                return parse_feed(feed)
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUSES:
+                    raise QueryError(f"arXiv returned {e.code} for {url}") from e
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, e.headers.get("Retry-After"))
+            except (OSError, ET.ParseError):  # connection errors, timeouts
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+            await asyncio.sleep(delay)
+
+    async def fetch_batch(self, batch: List[str]) -> List[Paper]:
+        """Fetch one id_list query.
+
+        arXiv rejects the whole query if any ID in it is malformed, so on an
+        error the batch is split in half until the bad IDs are isolated and
+        skipped.
+        """
+        try:
+            return await self.query(batch)
+        except QueryError:
+            if len(batch) == 1:
+                return []
+            middle = len(batch) // 2
+            halves = await asyncio.gather(
+                self.fetch_batch(batch[:middle]), self.fetch_batch(batch[middle:])
+            )
+            return halves[0] + halves[1]
+
+    async def fetch_batches(
+        self,
+        batches: List[List[str]],
+        on_batch: Optional[Callable[[List[str], List[Paper]], None]] = None,
+    ) -> List[List[Paper]]:
+        """Fetch all batches concurrently, calling `on_batch` as each finishes.
+
+        A batch that still fails after every retry is skipped with a
+        warning, rather than stopping the others.
+        """
+
+        async def run(batch):
+            try:
+                papers = await self.fetch_batch(batch)
+            except (OSError, ET.ParseError) as e:
+                warnings.warn(f"Couldn't fetch {len(batch)} arXiv IDs: {e}")
+                papers = []
+            if on_batch is not None:
+                on_batch(batch, papers)
+            return papers
+
+        return await asyncio.gather(*(run(batch) for batch in batches))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import asyncio
+import argparse
+from typing import Dict, Iterable, Optional
+from tqdm import tqdm
+from kvcache import Cache
+from arxiv_client import (
+    ARXIV_API_URL,
+    CONCURRENCY,
+    REQUEST_RATE,
+    ArxivClient,
+    Paper,
+    strip_version,
+)
+
+# arXiv accepts long id_lists, but keep each request to a single page
+BATCH_SIZE = 200
+
+CACHE_TTL_DAYS = 30
+CACHE_MAX_ENTRIES = 100_000
+
+
+def fetch_papers(
+    arxiv_ids: Iterable[str],
+    batch_size: int = BATCH_SIZE,
+    cache: Optional[Cache] = None,
+    refresh: bool = False,
+    client: Optional[ArxivClient] = None,
+) -> Dict[str, Paper]:
+    """Look up arXiv papers in batches, rather than one request per ID.
+
+    Papers already in `cache` are not requested again, unless `refresh` is
+    set, and newly fetched papers are added to it.
+    Returns a mapping from each requested ID to its paper, leaving out IDs
+    that arXiv does not know about.
+    """
+    ids = list(dict.fromkeys(arxiv_ids))  # drop repeats, keep order
+
+    papers = {}
+    if cache is not None and not refresh:
+        for arxiv_id, fields in cache.get_many(ids).items():
+            papers[arxiv_id] = Paper(**fields)
+    missing = [arxiv_id for arxiv_id in ids if arxiv_id not in papers]
+    batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+    if not batches:
+        return papers
+
+    progress = tqdm(total=len(batches))
+
+    def on_batch(batch, batch_papers):
+        found = {}
+        for paper in batch_papers:
+            found[paper.arxiv_id + (paper.version or "")] = paper
+            found.setdefault(paper.arxiv_id, paper)
+
+        fetched = {}
+        for arxiv_id in batch:
+            paper = found.get(arxiv_id) or found.get(strip_version(arxiv_id))
+            if paper is not None:
+                fetched[arxiv_id] = paper
+        papers.update(fetched)
+        if cache is not None:
+            # cache as we go, so an interrupted run keeps what it fetched
+            cache.set_many({k: paper._asdict() for k, paper in fetched.items()})
+        progress.update(1)
+
+    if client is None:
+        client = ArxivClient()
+    asyncio.run(client.fetch_batches(batches, on_batch))
+    progress.close()
+    return papers
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached arXiv metadata, and fetch it again",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=CACHE_TTL_DAYS,
+        help="Days before cached arXiv metadata is fetched again",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=CACHE_MAX_ENTRIES,
+        help="Maximum number of papers kept in the arXiv metadata cache",
+    )
+
+
+def add_client_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--arxiv_url",
+        type=str,
+        default=ARXIV_API_URL,
+        help="arXiv API endpoint, e.g. a mirror or a local stub server",
+    )
+    parser.add_argument(
+        "--arxiv_rate",
+        type=float,
+        default=REQUEST_RATE,
+        help="Maximum sustained arXiv requests per second",
+    )
+    parser.add_argument(
+        "--arxiv_concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help="Maximum arXiv requests in flight at once",
+    )
+
+
+def open_client(args: argparse.Namespace) -> ArxivClient:
+    return ArxivClient(
+        base_url=args.arxiv_url,
+        rate=args.arxiv_rate,
+        concurrency=args.arxiv_concurrency,
+    )
+
+
+def open_cache(args: argparse.Namespace) -> Cache:
+    return Cache(
+        "arxiv", ttl=args.cache_ttl * 24 * 60 * 60, max_entries=args.cache_size
+    )
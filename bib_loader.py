@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import hashlib
+import pickle
+import itertools
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+from bibtexparser.bparser import BibTexParser
+
+# bump when the snapshot layout changes, so old snapshots are ignored
+SNAPSHOT_VERSION = 3
+MAX_SNAPSHOTS = 16
+
+_DELIMITERS = re.compile(rb"[{})]")
+# e.g. `@article{`, but not the `@` of an email address between entries
+ENTRY_START = re.compile(rb"@\s*[a-zA-Z][\w-]*\s*[{(]")
+ENTRY_LINE = re.compile(rb"\s*@\s*[a-zA-Z][\w-]*\s*[{(]")
+STRING_BLOCK = re.compile(rb"@\s*string\s*[{(]", re.IGNORECASE)
+
+
+class SourceEntry(NamedTuple):
+    entry: dict
+    offset: int  # byte offset of the entry's `@` in the file
+    line: int  # line number of the entry's `@`, counting from 1
+
+
+def cache_dir(*parts: str) -> str:
+    """Directory for bib-boi's caches, created on first use"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, "bib-boi", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def snapshot_path(digest: str, customization=None) -> str:
+    variant = customization.__name__ if customization else "default"
+    return os.path.join(
+        cache_dir("snapshots"), f"{digest}-{variant}-v{SNAPSHOT_VERSION}.pickle"
+    )
+
+
+def prune_snapshots(keep: int = MAX_SNAPSHOTS):
+    """Remove the least recently used snapshots, beyond `keep`"""
+    directory = cache_dir("snapshots")
+    paths = [
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if f.endswith(".pickle")
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_raw_entries(filename: os.PathLike) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield the raw text of each `@type{...}` block in a bibtex file, with
+    the byte offset and line number it starts at.
+
+    Blocks are found by matching the braces (or parentheses) after the
+    `@type`, reading one line at a time, so only a single block is held in
+    memory.
+    Text between blocks is ignored, as bibtex does, and a block that isn't
+    closed, e.g. for a missing brace, ends where a line starts a new one.
+    """
+    block = None  # pieces of the block being read, or None between blocks
+    offset = 0
+    with open(filename, "rb") as f:
+        for line_no, line in enumerate(f, start=1):
+            if block is not None and ENTRY_LINE.match(line):
+                yield b"".join(block), block_offset, block_line  # unterminated
+                block = None
+            start = position = 0  # where the block starts, and where to scan from
+            while True:
+                if block is None:
+                    match = ENTRY_START.search(line, position)
+                    if match is None:
+                        break
+                    block, start, position = [], match.start(), match.end()
+                    block_offset, block_line = offset + match.start(), line_no
+                    closer = b"}" if line[position - 1 : position] == b"{" else b")"
+                    depth = 1 if closer == b"}" else 0
+                for match in _DELIMITERS.finditer(line, position):
+                    char = match.group()
+                    if char == b"{":
+                        depth += 1
+                    elif char == b"}":
+                        depth -= 1
+                    if depth == 0 and (closer == b"}" or char == b")"):
+                        block.append(line[start : match.end()])
+                        yield b"".join(block), block_offset, block_line
+                        block, position = None, match.end()
+                        break
+                else:
+                    block.append(line[start:])
+                    break
+            offset += len(line)
+    if block:
+        yield b"".join(block), block_offset, block_line  # unterminated entry
+
+
+def block_parser(customization=None) -> BibTexParser:
+    parser = BibTexParser(customization=customization)
+    parser.expect_multiple_parse = True
+    return parser
+
+
+def parse_block(parser: BibTexParser, text: bytes) -> List[dict]:
+    """Parse one raw block with a reused parser, returning its entries"""
+    database = parser.bib_database
+    database.entries = []
+    parser.parse(text.decode("utf-8"), partial=True)
+    # only @string definitions need to outlive their block
+    database.comments.clear()
+    database.preambles.clear()
+    return database.entries
+
+
+def stream_entries(filename: os.PathLike, customization=None) -> Iterator[SourceEntry]:
+    """Parse a bibtex file one entry at a time, in bounded memory.
+
+    A single parser is reused for every block, so `@string` macros defined
+    earlier in the file are still expanded in later entries.
+    """
+    parser = block_parser(customization)
+    for text, offset, line in iter_raw_entries(filename):
+        for entry in parse_block(parser, text):
+            yield SourceEntry(entry, offset, line)
+
+
+class IncrementalParser:
+    """Parses a bibtex file over and over, e.g. while watching it.
+
+    The parsed entries of each raw block are kept, keyed by a hash of the
+    block's text, so after an edit only the blocks that changed are parsed.
+    Splitting the file into blocks is much cheaper than parsing it.
+    """
+
+    def __init__(self, customization=None):
+        self.customization = customization
+        self.blocks = {}
+        self.strings = None
+
+    def parse(self, filename: os.PathLike) -> List[SourceEntry]:
+        raw_entries = list(iter_raw_entries(filename))
+        strings = [text for text, _, _ in raw_entries if STRING_BLOCK.match(text)]
+        if strings != self.strings:
+            # any entry could use the macros, so parse everything again
+            self.blocks = {}
+            self.strings = strings
+        parser = block_parser(self.customization)
+        for text in strings:
+            parse_block(parser, text)
+
+        blocks = {}
+        source_entries = []
+        for text, offset, line in raw_entries:
+            if STRING_BLOCK.match(text):
+                continue  # parsed above, and has no entries
+            digest = hashlib.sha1(text).digest()
+            if digest not in blocks:
+                blocks[digest] = self.blocks.get(digest)
+                if blocks[digest] is None:
+                    blocks[digest] = parse_block(parser, text)
+            source_entries.extend(SourceEntry(e, offset, line) for e in blocks[digest])
+        self.blocks = blocks
+        return source_entries
+
+
+def entry_hash(entry: dict) -> str:
+    """Hash of an entry's fields, ignoring field order and whitespace"""
+    fields = {k: " ".join(str(v).split()) for k, v in entry.items()}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(filename: os.PathLike) -> str:
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_snapshot(path: str) -> Iterator[SourceEntry]:
+    with open(path, "rb") as f:
+        os.utime(path)  # mark as recently used
+        while True:
+            try:
+                yield SourceEntry(*pickle.load(f))
+            except EOFError:
+                return
+
+
+def write_snapshot(
+    path: str, source_entries: Iterable[SourceEntry]
+) -> Iterator[SourceEntry]:
+    """Yield `source_entries`, storing them in the snapshot at `path` as they
+    go by, which is only kept if all of them were stored"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for source_entry in source_entries:
+                # plain tuples, so the snapshot doesn't depend on where
+                # `SourceEntry` was imported from
+                pickle.dump(tuple(source_entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+                yield source_entry
+        os.replace(tmp_path, path)
+        prune_snapshots()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)  # stopped early
+
+
+def iter_entries(
+    filename: os.PathLike, customization=None, use_cache=True
+) -> Iterator[SourceEntry]:
+    """Yield the entries of a bibtex file as they are parsed, in bounded
+    memory.
+
+    The parsed entries are kept as a pickled snapshot, named by the hash of
+    the file's contents, so repeat runs on an unchanged file skip parsing.
+    Editing the file changes the hash, which invalidates the snapshot.
+    """
+    if not use_cache:
+        yield from stream_entries(filename, customization)
+        return
+    path = snapshot_path(file_digest(filename), customization)
+    read = 0
+    try:
+        for source_entry in read_snapshot(path):
+            yield source_entry
+            read += 1
+        return
+    except (OSError, pickle.UnpicklingError, TypeError):
+        pass  # missing or unreadable snapshot, so parse again
+    source_entries = write_snapshot(path, stream_entries(filename, customization))
+    yield from itertools.islice(source_entries, read, None)
+
+
+def load_source_entries(filename: os.PathLike, customization=None, use_cache=True):
+    """Parse a bibtex file into a list of `SourceEntry`, see `iter_entries`"""
+    return list(iter_entries(filename, customization, use_cache))
+
+
+def load_entries(filename: os.PathLike, customization=None, use_cache=True):
+    """Parse the entries of a bibtex file, see `iter_entries`"""
+    return [s.entry for s in iter_entries(filename, customization, use_cache)]
+
+
+if __name__ == "__main__":
+    """Parse a bibtex file, and store its snapshot for the other tools"""
+    if len(sys.argv) < 2:
+        print("Usage: python bib_loader.py bibtex_file")
+    else:
+        bibtex_file = sys.argv[1]
+        entries = load_entries(bibtex_file)
+        print(f"Loaded {bibtex_file}, found {len(entries)} entries")
@@ -1,28 +1,51 @@
 #!/usr/bin/env python3
 
-import openai
 from tqdm import tqdm
-import os
+import re
 import sys
+import warnings
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Union, Dict
-from bibtexparser.bparser import BibTexParser
 from bibtexparser.customization import convert_to_unicode
 import gender_guesser.detector as gender_guesser
+from bib_loader import load_entries
+from kvcache import Cache
+from llm_backend import OpenAIBackend
+from telemetry import Telemetry
+
+MODEL = "gpt-3.5-turbo"
+# names per request, so replies stay well within the output limit
+BATCH_SIZE = 100
+CONCURRENCY = 4
+GENDER_PROMPT = """Below lists the first names for the authors of research papers.
+    For each, guess the most likely gender given the name.
+    M for male, F for female, A for ambigous, U for unknown.
+    Return data in the format, with no additional text:
+
+    Jack: M
+    Susan: F
+    Pauley: A
+    PyTorch: U
+
+    The next message includes the list:
+    """
+# e.g. "Jack: M" or "Jack: Male", allowing for list markers
+GUESS_PATTERN = re.compile(
+    r"^[\s*\-\d.)]*(.+?)\s*:\s*(m(?:ale)?|f(?:emale)?|a(?:mbigu?ous)?|u(?:nknown)?)\b",
+    re.IGNORECASE,
+)
 
 
 def get_authors_bibtex(filename: str) -> List[str]:
-    with open(filename, "r") as bibtex_file:
-        bib_db = BibTexParser(
-            bibtex_file.read(), customization=convert_to_unicode
-        )  # .get_database()
+    entries = load_entries(filename, customization=convert_to_unicode)
     author_list = []
-    for entry in bib_db.entries:
+    for entry in entries:
         authors = entry.get("author", "").split(" and ")
         author_list.extend(authors)
 
-    print("#Papers:", len(bib_db.entries))
+    print("#Papers:", len(entries))
     print("#Authors:", len(author_list))
     print("#Authors_unique:", len(list(set(author_list))))
     print()
@@ -74,90 +97,76 @@ def process_gender_stats(authors: List[str]) -> Union[int, float]:
     return list(first_names), name_count, guesses
 
 
-def query_response(messages, model, num_names):
-
-    # completion = openai.Completion.create(
-    #     model=model,
-    #     prompt=messages,
-    # )
-    # out = completion.choices[0].text
-    # completion = openai.ChatCompletion.create(
-    #     model=model,
-    #     messages=messages,
-    # )
-    # out = completion.choices[0].message.content
-
-    # for some reason, at time of developing, this only worked when
-    # I streamed the output data.
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0,
-        stream=True,
-    )
-    completion_text = ""
-
-    with tqdm(total=num_names) as pbar:
-        for chunk in response:
-            try:
-                event_text = chunk["choices"][0]["delta"]["content"]
-            except Exception as e:
-                if chunk["choices"][0]["finish_reason"] == "stop":
-                    break
-                else:
-                    raise e
-            completion_text += event_text
-            if "\n" in event_text:
-                pbar.update(1)
-    return completion_text
-
-
-def llm_based_gender_estimate(
-    first_names: List[str], name_count: Dict[str, int], bib_file: os.PathLike
-):
-    model = "gpt-3.5-turbo-16k"
-    # model = "gpt-4"
-    # model = "text-davinci-003"
-    message = """Below lists the first names for the authors of research papers.
-    For each, guess the most likely gender given the name.
-    M for male, F for female, A for ambigous, U for unknown.
-    Return data in the format, with no additional text:
-
-    Jack: M
-    Susan: F
-    Pauley: A
-    PyTorch: U
-
-    The next message includes the list:
-    """
-
-    bib_file = bib_file.replace("..", "")
-    bib_file = bib_file.replace("/", "")
-    cache_file = f"/tmp/llm_gender_guess_{bib_file}.txt"
-
-    # LLM inference is expensive, check if we've run it before
-    if not os.path.exists(cache_file):
-        messages = []
-        messages.append({"role": "system", "content": message})
-        messages.append({"role": "user", "content": "\n".join(first_names)})
-
-        out = query_response(messages, model, len(first_names))
-
-        guesses = out.split("\n")
-
-        with open(cache_file, "w") as f:
-            f.write(out)
-    else:
-        with open(cache_file, "r") as file:
-            guesses = file.readlines()
+def parse_guesses(reply: str, names: List[str]) -> Dict[str, str]:
+    """Guesses for `names` from a reply, skipping lines that don't parse or
+    are about names that weren't asked about"""
+    lookup = {name.lower(): name for name in names}
+    guesses = {}
+    for line in reply.splitlines():
+        match = GUESS_PATTERN.match(line)
+        if match and match.group(1).strip().lower() in lookup:
+            guesses[lookup[match.group(1).strip().lower()]] = match.group(2)[0].upper()
+    return guesses
+
+
+def classify_names(backend, names: List[str]) -> Dict[str, str]:
+    messages = [
+        {"role": "system", "content": GENDER_PROMPT},
+        {"role": "user", "content": "\n".join(names)},
+    ]
+    return parse_guesses(backend.complete(MODEL, messages).text, names)
+
+
+def llm_gender_guesses(
+    backend,
+    names: List[str],
+    cache: Cache,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+) -> Dict[str, str]:
+    """The guessed gender of each name, only asking about the names that
+    aren't in `cache`, `batch_size` per request and `concurrency` at once"""
+    keys = {name: f"{MODEL}:{name}" for name in names}
+    cached = cache.get_many(keys.values())
+    guesses = {name: cached[key] for name, key in keys.items() if key in cached}
+    missing = sorted(name for name in names if name not in guesses)
+    print(f"Asking about {len(missing)} of {len(names)} names, {batch_size} at a time")
+
+    # names left out of a reply are asked about once more
+    for _ in range(2):
+        if not missing:
+            break
+        batches = [
+            missing[i : i + batch_size] for i in range(0, len(missing), batch_size)
+        ]
+        with ThreadPoolExecutor(concurrency) as pool:
+            futures = [pool.submit(classify_names, backend, b) for b in batches]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                batch_guesses = future.result()
+                guesses.update(batch_guesses)
+                # only written from this thread, as SQLite connections can't
+                # be shared between threads
+                cache.set_many({keys[n]: g for n, g in batch_guesses.items()})
+        missing = [name for name in missing if name not in guesses]
+    if missing:
+        warnings.warn(f"No guess for {len(missing)} names, counting them as unknown")
+    return guesses
+
+
+def llm_based_gender_estimate(first_names: List[str], name_count: Dict[str, int]):
+    backend = OpenAIBackend(temperature=0)
+    backend.telemetry = Telemetry("bib_stats")
+    # LLM inference is expensive, so guesses are kept for each name
+    with Cache("gender") as cache:
+        guesses = llm_gender_guesses(backend, first_names, cache)
+    if backend.telemetry.records:
+        print(backend.telemetry.summary())
 
     male, female, andy, unknown = 0, 0, 0, 0
     llm_guesses = dict()
 
-    for g in guesses:
-        # this means we reduce the number of LLM tokens
-        name, gender_guess = g.split(": ")
-        name, gender_guess = name.strip(), gender_guess.strip()
+    for name in first_names:
+        gender_guess = guesses.get(name, "U")
         if gender_guess == "M":
             male += name_count[name]
             llm_guesses[name] = "M"
@@ -194,7 +203,7 @@ def main(bib_file):
     first_names, name_count, guesses = process_gender_stats(authors)
     print()
     print("# LLM mode")
-    llm_guesses = llm_based_gender_estimate(first_names, name_count, bib_file)
+    llm_guesses = llm_based_gender_estimate(first_names, name_count)
 
     # print(find_disagreements(guesses, llm_guesses))
 
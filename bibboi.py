@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import contextlib
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from typing import List
+from arxiv_lookup import (
+    add_cache_arguments,
+    add_client_arguments,
+    open_cache,
+    open_client,
+)
+from bib_loader import IncrementalParser, iter_entries
+from lint import RULES, check, format_diagnostic, run_rules
+from verified import VERIFIED_PATH, VerificationStore
+from watch import Watcher
+
+# checks that entries can be verified for, skipping them from then on
+VERIFIABLE = ["arxiv", "capitals"]
+
+
+def rule_names(names: str) -> List[str]:
+    """Rule names from a comma separated list, for `--rules`"""
+    names = names.split(",")
+    unknown = [name for name in names if name not in RULES]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown rules {unknown}, choose from {list(RULES)}"
+        )
+    return names
+
+
+def build_rules(args: argparse.Namespace):
+    args.store = VerificationStore(args.verified)
+    return [RULES[name].from_args(args) for name in args.rules or list(RULES)]
+
+
+def watch(args: argparse.Namespace):
+    """Check the bib file every time it changes, until interrupted.
+
+    The parsed entries, the rules (including the duplicate index) and their
+    results stay in memory between checks, so each check only parses and
+    checks the entries that changed.
+    """
+    bib_parser = IncrementalParser()
+    rules = build_rules(args)
+    state = {}
+    bibtex_file = os.path.abspath(args.bibtex_file)
+    with Watcher([bibtex_file] + args.watch_also) as watcher:
+        while True:
+            start = time.perf_counter()
+            try:
+                source_entries = bib_parser.parse(bibtex_file)
+            except FileNotFoundError:
+                source_entries = None  # midway through being replaced
+            if source_entries is not None:
+                diagnostics = run_rules(source_entries, rules, state)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"\n[{datetime.now():%H:%M:%S}] {len(diagnostics)} issues "
+                    + f"in {len(source_entries)} entries ({elapsed * 1000:.0f} ms)"
+                )
+                for diagnostic in diagnostics:
+                    print(format_diagnostic(args.bibtex_file, diagnostic))
+
+            changed = watcher.wait()
+            if changed - {bibtex_file}:
+                # e.g. the verified keys changed, so start the rules afresh
+                rules = build_rules(args)
+
+
+def check_command(args: argparse.Namespace) -> int:
+    # the cache and the arXiv client are only needed to look entries up
+    with open_cache(args) if args.online else contextlib.nullcontext() as cache:
+        args.cache = cache
+        args.client = open_client(args) if args.online else None
+        if args.watch:
+            try:
+                watch(args)
+            except KeyboardInterrupt:
+                return 0
+        rules = build_rules(args)
+        diagnostics = check(args.bibtex_file, rules, incremental=args.incremental)
+
+    for diagnostic in diagnostics:
+        print(format_diagnostic(args.bibtex_file, diagnostic))
+    return 1 if diagnostics else 0
+
+
+def verify_command(args: argparse.Namespace) -> int:
+    """Record entries, as they are now, as manually checked"""
+    keys = set(args.keys)
+    entries = [e for e, _, _ in iter_entries(args.bibtex_file) if e["ID"] in keys]
+    missing = keys - {entry["ID"] for entry in entries}
+    if missing:
+        raise ValueError(f"No entries in {args.bibtex_file} for {sorted(missing)}")
+    VerificationStore(args.verified).add(args.check, entries)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tools to help with LaTeX writing")
+    subparsers = parser.add_subparsers(required=True)
+
+    check_parser = subparsers.add_parser(
+        "check", help="Run the bibliography checks in a single pass"
+    )
+    check_parser.add_argument("bibtex_file", type=str, help="bibtex file to check")
+    check_parser.add_argument(
+        "--rules",
+        type=rule_names,
+        default=None,
+        help=f"Comma separated checks to run, from: {', '.join(RULES)} (default: all)",
+    )
+    check_parser.add_argument(
+        "--online",
+        action="store_true",
+        help="Look up arXiv entries, to only report the ones that may be published",
+    )
+    check_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to score duplicate candidates",
+    )
+    check_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only check entries that were added or modified since the last run",
+    )
+    check_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and check the bib file again whenever it changes",
+    )
+    check_parser.add_argument(
+        "--watch_also",
+        nargs="*",
+        default=[],
+        help="Other files (e.g. verified keys) or TeX directories that should "
+        + "trigger a check in --watch mode",
+    )
+    check_parser.add_argument(
+        "--verified",
+        type=str,
+        default=VERIFIED_PATH,
+        help="File of manually verified entries",
+    )
+    add_cache_arguments(check_parser)
+    add_client_arguments(check_parser)
+    check_parser.set_defaults(command=check_command)
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Mark entries as manually checked, until they are next edited",
+    )
+    verify_parser.add_argument("check", choices=VERIFIABLE, help="check to skip")
+    verify_parser.add_argument("bibtex_file", type=str, help="bibtex file")
+    verify_parser.add_argument("keys", nargs="+", help="citekeys to mark")
+    verify_parser.add_argument(
+        "--verified",
+        type=str,
+        default=VERIFIED_PATH,
+        help="File of manually verified entries",
+    )
+    verify_parser.set_defaults(command=verify_command)
+
+    args = parser.parse_args()
+    sys.exit(args.command(args))
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
 
-import os
 import sys
-import bibtexparser
-from bibtexparser.bparser import BibTexParser
-
+from bib_loader import iter_entries
+from verified import VerificationStore
 
 common_words = [
     "in",
@@ -62,45 +60,33 @@ def check_capitalization(title):
     return True, None
 
 
-def load_manual_data(path: os.PathLike):
-    checked_keys = []
+def entry_issues(entry):
+    """Yield a description of each capitalization issue in an entry"""
+    if entry.get("title"):
+        title_pass, word = check_capitalization(entry["title"])
+        if not title_pass:
+            yield f"Capitalization issue in paper title: {strip(entry['title'])}, trigger: `{word}`"
 
-    if os.path.exists(path):
-        with open(path) as f:
-            while line := f.readline():
-                checked_keys.append(line.rstrip())
-    return checked_keys
+    if entry.get("booktitle"):
+        title_pass, word = check_capitalization(entry["title"])
+        if not title_pass:
+            yield f"Capitalization issue in conference title: {strip(entry['booktitle'])}, trigger: `{word}`"
 
 
 def find_issues(filename):
-    with open(filename) as bibtex_file:
-        parser = BibTexParser()
-        bib_database = bibtexparser.load(bibtex_file, parser=parser)
-
-    checked_keys = load_manual_data("verified_capital.txt")
+    store = VerificationStore()
 
-    for i, entry in enumerate(bib_database.entries):
+    for entry, offset, line in iter_entries(filename):
         key = entry["ID"]
-        if key in checked_keys:
+        if store.is_verified("capitals", entry):
             continue
 
-        if entry.get("title"):
-            title_pass, word = check_capitalization(entry["title"])
-            if not title_pass:
-                print(
-                    f"Capitalization issue in paper title: {strip(entry['title'])}, trigger: `{word}`, citekey: {key}"
-                )
-
-        if entry.get("booktitle"):
-            title_pass, word = check_capitalization(entry["title"])
-            if not title_pass:
-                print(
-                    f"Capitalization issue in conference title: {strip(entry['booktitle'])}, trigger: `{word}`, citekey: {key}"
-                )
+        for issue in entry_issues(entry):
+            print(f"{issue}, citekey: {key}")
 
 
 if __name__ == "__main__":
-    """Checks the file `verified_capital.txt` for cite keys.
+    """Skips entries verified with `bibboi.py verify capitals`.
     Checks a bibtex file for possible captialization issues in the
     paper or conference title.
     """
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
-import sys
-from collections import defaultdict
+import argparse
+from collections import Counter, defaultdict
+from bisect import bisect_left, bisect_right
+from multiprocessing import Pool
 from tqdm import tqdm
 import Levenshtein
-import bibtexparser
+from bib_loader import load_entries
+from identifiers import KINDS, exact_duplicate_pairs, exact_groups, identifiers
 
 MAX_LEVENSHTEIN_DISTANCE = 3
+TITLE_QGRAM = 3
 
 
 def parse_authors(entry):
@@ -18,9 +22,13 @@ def parse_authors(entry):
         return set()
 
 
+def normalize_title(title):
+    return title.strip().lower()
+
+
 def similar_titles(title1, title2):
     return (
-        Levenshtein.distance(title1.strip().lower(), title2.strip().lower())
+        Levenshtein.distance(normalize_title(title1), normalize_title(title2))
         <= MAX_LEVENSHTEIN_DISTANCE
     )
 
@@ -29,41 +37,261 @@ def authors_overlap(authors1, authors2):
     return len(authors1.intersection(authors2)) > 0
 
 
-def main(bibtex_file):
-    with open(bibtex_file, "r") as file:
-        bibtex_str = file.read()
+def is_duplicate(title1, title2, authors1, authors2):
+    return (
+        similar_titles(title1, title2)
+        or authors_overlap(authors1, authors2)
+        or (normalize_title(title1) == normalize_title(title2) and authors1 == authors2)
+    )
+
 
-    bib_database = bibtexparser.loads(bibtex_str)
-    entries = bib_database.entries
-    print(f"Loaded {bibtex_file}, found {len(entries)} entries")
+def title_qgrams(title):
+    return {
+        title[i : i + TITLE_QGRAM] for i in range(len(title) - TITLE_QGRAM + 1)
+    } or {title}
+
+
+def build_index(titles, authors):
+    """Blocking indexes over normalized titles and parsed author sets.
+
+    Each edit destroys at most `TITLE_QGRAM` q-grams, so two titles within
+    distance k share at least `max(|G1|, |G2|) - k * q` distinct q-grams.
+    By the prefix filtering argument they must then share one of their
+    `k * q + 1` rarest q-grams, which is all we index.
+    Titles with too few q-grams for that bound to say anything are compared
+    against every title of a similar length instead.
+    Pairs sharing an author come from an inverted author index.
+    """
+    index = {
+        # prefix filtering only needs a fixed order of q-grams, so the
+        # frequencies are not updated as entries are added or removed
+        "frequency": Counter(g for t in titles for g in title_qgrams(t)),
+        "titles": {},
+        "authors": {},
+        "prefixes": {},
+        "short": {},
+        "prefix_index": defaultdict(list),
+        "author_index": defaultdict(list),
+        "by_length": defaultdict(list),
+        "short_by_length": defaultdict(list),
+    }
+    for idx, (title, names) in enumerate(zip(titles, authors)):
+        if title:  # entries without a title aren't fuzzy matched
+            add_to_index(index, idx, title, names)
+    return index
+
+
+def _postings(index, idx):
+    title = index["titles"][idx]
+    postings = [index["prefix_index"][g] for g in index["prefixes"][idx]]
+    postings += [index["author_index"][name] for name in index["authors"][idx]]
+    postings.append(index["by_length"][len(title)])
+    if index["short"][idx]:
+        postings.append(index["short_by_length"][len(title)])
+    return postings
+
+
+def add_to_index(index, idx, title, authors):
+    """Add an entry, whose `idx` must be larger than any already indexed"""
+    max_edits = MAX_LEVENSHTEIN_DISTANCE * TITLE_QGRAM
+    grams = title_qgrams(title)
+    frequency = index["frequency"]
+    index["titles"][idx] = title
+    index["authors"][idx] = authors
+    index["prefixes"][idx] = sorted(grams, key=lambda g: (frequency[g], g))[
+        : max_edits + 1
+    ]
+    index["short"][idx] = len(grams) <= max_edits
+    for postings in _postings(index, idx):
+        postings.append(idx)
+
+
+def remove_from_index(index, idx):
+    for postings in _postings(index, idx):
+        del postings[bisect_left(postings, idx)]
+    for field in ("titles", "authors", "prefixes", "short"):
+        del index[field][idx]
+
+
+def blocks_of(index, idx):
+    """Postings lists of every block that entry `idx` is in.
+    Blocks are symmetric, so these hold every candidate partner of `idx`."""
+    title = index["titles"][idx]
+    blocks = [index["prefix_index"][g] for g in index["prefixes"][idx]]
+    blocks += [index["author_index"][name] for name in index["authors"][idx]]
+    length_index = index["short_by_length"]
+    if index["short"][idx]:
+        length_index = index["by_length"]
+    for length in range(
+        len(title) - MAX_LEVENSHTEIN_DISTANCE,
+        len(title) + MAX_LEVENSHTEIN_DISTANCE + 1,
+    ):
+        blocks.append(length_index.get(length, ()))
+    return blocks
+
+
+def candidate_pairs(index, start=0, stop=None, changed=None):
+    """Yield, in order, the pairs `(i, j)` with `start <= i < stop` and `i < j`
+    that share a block, and so could be duplicates.
+
+    If `changed` is given, only the pairs involving one of those indices are
+    yielded, each once for whichever changed index of the pair is in
+    `[start, stop)`, and not in order.
+    """
+    if stop is None:
+        stop = max(index["titles"], default=-1) + 1
+
+    if changed is not None:
+        for idx in sorted(
+            i for i in changed if start <= i < stop and i in index["titles"]
+        ):
+            others = set()
+            for block in blocks_of(index, idx):
+                others.update(block)
+            for other in sorted(others):
+                if other != idx and not (other in changed and other < idx):
+                    yield min(idx, other), max(idx, other)
+        return
+
+    for idx in range(start, stop):
+        if idx not in index["titles"]:
+            continue  # removed from the index
+        others = set()
+        for block in blocks_of(index, idx):
+            # postings are in index order, so skip straight to later entries
+            others.update(block[bisect_right(block, idx) :])
+        for other in sorted(others):
+            yield idx, other
+
+
+def score_pairs(index, start=0, stop=None, changed=None, progress=False, groups=None):
+    """Candidate pairs in `[start, stop)` that pass the duplicate check,
+    other than those in the same one of `groups`, see `exact_groups`"""
+    groups = groups or {}
+    titles, authors = index["titles"], index["authors"]
+    candidates = candidate_pairs(index, start, stop, changed)
+    return [
+        (i, j)
+        for i, j in (tqdm(candidates) if progress else candidates)
+        if i not in groups
+        or groups[i] != groups.get(j)
+        and is_duplicate(titles[i], titles[j], authors[i], authors[j])
+    ]
 
+
+# state shared with pool workers once, by `_init_worker`, rather than per task
+_worker_state = {}
+
+
+def _init_worker(index, changed, groups):
+    _worker_state["index"] = index
+    _worker_state["changed"] = changed
+    _worker_state["groups"] = groups
+
+
+def _score_chunk(bounds):
+    return score_pairs(
+        _worker_state["index"],
+        *bounds,
+        _worker_state["changed"],
+        groups=_worker_state["groups"],
+    )
+
+
+def score_index(index, jobs=1, chunk_size=256, changed=None, groups=None):
+    """Index pairs `(i, j)`, with `i < j`, of entries that could be duplicates.
+
+    Only pairs sharing a title q-gram block or an author are scored,
+    which gives the same result as comparing every pair of entries.
+    If `changed` is given, only pairs involving one of those indices are
+    scored.
+    Pairs of entries in the same one of `groups`, mapping indices to the
+    group of exact duplicates they are in, are never scored.
+    With `jobs > 1` ranges of `chunk_size` entries are scored in a process
+    pool, and merged back in order.
+    """
+    if jobs <= 1:
+        return score_pairs(index, changed=changed, progress=True, groups=groups)
+
+    stop = max(index["titles"], default=-1) + 1
+    chunks = [
+        (start, min(start + chunk_size, stop)) for start in range(0, stop, chunk_size)
+    ]
+    pairs = []
+    with Pool(
+        jobs, initializer=_init_worker, initargs=(index, changed, groups)
+    ) as pool:
+        for chunk_pairs in tqdm(pool.imap(_score_chunk, chunks), total=len(chunks)):
+            pairs.extend(chunk_pairs)
+    return pairs
+
+
+def index_entries(entries):
+    titles = [normalize_title(entry.get("title", "")) for entry in entries]
+    return build_index(titles, [parse_authors(entry) for entry in entries])
+
+
+def find_duplicate_pairs(entries, jobs=1, chunk_size=256, changed=None, groups=None):
+    """Index pairs of entries that could be duplicates, see `score_index`"""
+    return score_index(index_entries(entries), jobs, chunk_size, changed, groups)
+
+
+def group_pairs(entries, pairs):
+    """Map each citekey to the later citekeys that could duplicate it"""
     duplicates = defaultdict(list)
+    for i, j in sorted(pairs):
+        if entries[j]["ID"] not in duplicates[entries[i]["ID"]]:
+            duplicates[entries[i]["ID"]].append(entries[j]["ID"])
+    return duplicates
+
+
+def find_duplicates(entries, jobs=1, chunk_size=256):
+    """Map each citekey to the later citekeys that could duplicate it"""
+    return group_pairs(entries, find_duplicate_pairs(entries, jobs, chunk_size))
 
-    for idx, entry1 in tqdm(enumerate(entries)):
-        title1 = entry1["title"]
-        authors1 = parse_authors(entry1)
 
-        for entry2 in entries[idx + 1 :]:
-            title2 = entry2["title"]
-            authors2 = parse_authors(entry2)
+def group_exact_pairs(entries, exact):
+    """Map each citekey to descriptions of the later entries sharing one of
+    its identifiers, e.g. `same DOI as key2, key3`"""
+    grouped = defaultdict(lambda: defaultdict(list))
+    for (i, j), kind in sorted(exact.items()):
+        if entries[j]["ID"] not in grouped[entries[i]["ID"]][kind]:
+            grouped[entries[i]["ID"]][kind].append(entries[j]["ID"])
+    return {
+        key: [
+            f"same {KINDS[kind]} as {', '.join(others)}"
+            for kind, others in kinds.items()
+        ]
+        for key, kinds in grouped.items()
+    }
 
-            if (
-                similar_titles(title1, title2)
-                or authors_overlap(authors1, authors2)
-                or (
-                    title1.strip().lower() == title2.strip().lower()
-                    and authors1 == authors2
-                )
-            ):
-                duplicates[entry1["ID"]].append(entry2["ID"])
 
+def main(bibtex_file, jobs=1):
+    entries = load_entries(bibtex_file)
+    print(f"Loaded {bibtex_file}, found {len(entries)} entries")
+
+    # exact duplicates are cheap to find, so report them first
+    exact = exact_duplicate_pairs(identifiers(entry) for entry in entries)
+    for key, messages in group_exact_pairs(entries, exact).items():
+        for message in messages:
+            print(f"{key} has the {message}")
+
+    groups = exact_groups(exact)
+    duplicates = group_pairs(
+        entries, find_duplicate_pairs(entries, jobs, groups=groups)
+    )
     for key, value in duplicates.items():
         print(f"{key} could be duplicated by {', '.join(value)}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python detect_duplicates.py bibtex_file")
-    else:
-        bibtex_file = sys.argv[1]
-        main(bibtex_file)
+    parser = argparse.ArgumentParser(description="Search for duplicated bibentries")
+    parser.add_argument("bibtex_file", type=str, help="bibtex file to check")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to score candidate pairs",
+    )
+    args = parser.parse_args()
+    main(args.bibtex_file, jobs=args.jobs)
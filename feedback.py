@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import Levenshtein
+
+# e.g. "- L12: Consider adding a citation", or "* L3-L5: ..."
+ITEM_PATTERN = re.compile(r"^\s*[-*]?\s*L(\d+)(?:\s*[-–]\s*L?\d+)?\s*[:.)]\s*(.+)$")
+FILE_PATTERN = re.compile(r"\[reviewing file:\s*`?([^`\]]+?)`?\s*\]")
+# a line of a chunk as sent for review, and where each file's lines start
+CHUNK_LINE_PATTERN = re.compile(r"^L(\d+)\t(.*)$")
+MARKER_PATTERN = re.compile(r"^\[started (.+?), start_line: \d+\]$")
+# text a comment quotes, "..." or `...`
+QUOTE_PATTERN = re.compile(r'"([^"]+)"|“([^”]+)”|`([^`]+)`')
+# text before a quote that makes it a suggested replacement, rather than
+# text the comment is about, e.g. `"teh" should be "the"`
+SUGGESTION_PATTERN = re.compile(
+    r"(?:\b(?:should (?:be|read)|spelled|spelt|with|to|or|consider|use|try|"
+    + r"prefer|suggest|e\.g\.|such as|like|perhaps|maybe)|->|→|=>)\W*$",
+    re.IGNORECASE,
+)
+# e.g. \emph{very}, matched against the quote "very"
+LATEX_PATTERN = re.compile(r"\\[a-zA-Z]+\*?|[{}]")
+# how alike two comments on nearby lines must be to count as the same one
+SIMILARITY = 0.6
+# the model is often off by a line or so, see the README
+LINE_TOLERANCE = 1
+
+
+class FeedbackItem(NamedTuple):
+    file: Optional[str]
+    line: int
+    text: str
+
+
+def parse_feedback(feedback: str) -> Tuple[List[FeedbackItem], List[str]]:
+    """Split a review into its per-line comments, and any other text"""
+    items, other = [], []
+    file = None
+    for line in feedback.splitlines():
+        if match := FILE_PATTERN.search(line):
+            file = match.group(1).strip()
+        elif match := ITEM_PATTERN.match(line):
+            items.append(
+                FeedbackItem(file, int(match.group(1)), match.group(2).strip())
+            )
+        elif line.strip():
+            other.append(line.strip())
+    return items, other
+
+
+def same_comment(a: FeedbackItem, b: FeedbackItem) -> bool:
+    return (
+        a.file == b.file
+        and abs(a.line - b.line) <= LINE_TOLERANCE
+        and Levenshtein.ratio(a.text.lower(), b.text.lower()) >= SIMILARITY
+    )
+
+
+def merge_feedback(items: Iterable[FeedbackItem]) -> List[FeedbackItem]:
+    """Order comments by file and line, dropping repeats, e.g. from windows
+    that overlap and both comment on the same line"""
+    merged = []
+    for item in sorted(items, key=lambda item: (item.file or "", item.line)):
+        for other in reversed(merged):
+            if other.file != item.file or item.line - other.line > LINE_TOLERANCE:
+                merged.append(item)  # sorted, so no earlier comment is close
+                break
+            if same_comment(item, other):
+                break
+        else:
+            merged.append(item)
+    return merged
+
+
+def format_feedback(items: Iterable[FeedbackItem]) -> str:
+    lines = []
+    file = None
+    for item in items:
+        if item.file != file and item.file is not None:
+            lines.append(f"\n[reviewing file: `{item.file}`]")
+        file = item.file
+        lines.append(f"- L{item.line}: {item.text}")
+    return "\n".join(lines).strip()
+
+
+def parse_chunk(chunk: str) -> Dict[Tuple[Optional[str], int], str]:
+    """The text of each numbered line of a chunk, by file and line number"""
+    lines = {}
+    file = None
+    for line in chunk.splitlines():
+        if match := MARKER_PATTERN.match(line):
+            file = match.group(1)
+        elif match := CHUNK_LINE_PATTERN.match(line):
+            lines[(file, int(match.group(1)))] = match.group(2)
+    return lines
+
+
+def normalise(text: str) -> str:
+    """Lower case text, without LaTeX commands, braces or extra spaces"""
+    text = LATEX_PATTERN.sub("", text.replace("~", " "))
+    return " ".join(text.lower().split())
+
+
+def quotes(text: str) -> List[str]:
+    """The text a comment quotes, other than its suggested replacements"""
+    quoted, position = [], 0
+    for match in QUOTE_PATTERN.finditer(text):
+        if not SUGGESTION_PATTERN.search(text[position : match.start()]):
+            quoted.append(normalise("".join(g or "" for g in match.groups())))
+        position = match.end()
+    return quoted
+
+
+def contains(text: str, quote: str) -> bool:
+    """Whether `quote` is in `text` as whole words, so "the" isn't in "then" """
+    return re.search(rf"(?<!\w){re.escape(quote)}(?!\w)", text) is not None
+
+
+def starts_on(
+    lines: Dict[Tuple[Optional[str], int], str],
+    key: Tuple[Optional[str], int],
+    quote: str,
+) -> bool:
+    """Whether `quote` starts on the line `key`, possibly running onto the
+    next one"""
+    next_line = normalise(lines.get((key[0], key[1] + 1), ""))
+    text = normalise(lines[key])
+    return contains(text, quote) or (
+        contains(f"{text} {next_line}", quote) and not contains(next_line, quote)
+    )
+
+
+def check_item(
+    item: FeedbackItem, lines: Dict[Tuple[Optional[str], int], str]
+) -> Optional[FeedbackItem]:
+    """`item` placed on the line it is about, or None if it should be dropped.
+
+    Comments quoting text that isn't in the chunk, e.g. typos the model
+    made up, are dropped, ignoring the replacements they suggest, e.g. the
+    "the" of `"teh" should be "the"`.
+    Other comments are moved to the nearest line with what they quote.
+    Comments without quotes are moved off lines that don't exist or are
+    blank to the nearest line within `LINE_TOLERANCE`, as the model is
+    often off by one, or dropped if there isn't one.
+
+    >>> lines = {(None, 60): "Then the results", (None, 61): "are opaque."}
+    >>> typo = '"opague" should be spelled "opaque".'  # from the README
+    >>> check_item(FeedbackItem(None, 61, typo), lines)
+    >>> check_item(FeedbackItem(None, 62, '"teh" should be "the"'), lines)
+    >>> check_item(FeedbackItem(None, 62, '"opaque" is vague'), lines)
+    FeedbackItem(file=None, line=61, text='"opaque" is vague')
+    """
+    files = list(dict.fromkeys(file for file, _ in lines))
+    if item.file in files:
+        files = [item.file]
+    candidates = [
+        key for key, text in lines.items() if key[0] in files and text.strip()
+    ]
+
+    quoted = quotes(item.text)
+    if quoted:
+        chunk_text = normalise(" ".join(lines.values()))
+        quoted = [q for q in quoted if contains(chunk_text, q)]
+        if not quoted:
+            return None
+        candidates = [
+            key for key in candidates if any(starts_on(lines, key, q) for q in quoted)
+        ]
+    else:
+        candidates = [
+            key for key in candidates if abs(key[1] - item.line) <= LINE_TOLERANCE
+        ]
+    if not candidates:
+        return None
+    file, line = min(candidates, key=lambda key: abs(key[1] - item.line))
+    return FeedbackItem(file, line, item.text)
+
+
+def validate_feedback(
+    items: Iterable[FeedbackItem], lines: Dict[Tuple[Optional[str], int], str]
+) -> Tuple[List[FeedbackItem], List[FeedbackItem]]:
+    """Comments checked against the chunk they are about, see `check_item`.
+    Returns the comments kept, and those dropped."""
+    kept, dropped = [], []
+    for item in items:
+        checked = check_item(item, lines)
+        if checked is None:
+            dropped.append(item)
+        else:
+            kept.append(checked)
+    return kept, dropped
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import os
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from feedback import parse_chunk
+from tokens import count_message_tokens, count_tokens
+
+# tokens sent with each follow-up query, however long the conversation
+QUERY_TOKENS = 2048
+# exchanges sent verbatim, older ones are summarised
+KEEP_TURNS = 2
+# lines either side of a referenced line that are sent with it
+CONTEXT_LINES = 2
+SUMMARY_CHARS = 200
+
+# queries are lowercased when they are read
+LINE_REF_PATTERN = re.compile(r"\bL(\d+)\b", re.IGNORECASE)
+
+
+Ref = Tuple[Optional[str], int]
+
+
+def line_refs(text: str, files: Iterable[str] = ()) -> List[Ref]:
+    """(file, line number) of each line mentioned in `text`, e.g. "L12", in
+    order. Lines mentioned after one of `files` is named, e.g. in a review's
+    `[reviewing file: ...]`, are in that file, otherwise the file is None."""
+    names = {}
+    for file in files:
+        names[file.lower()] = file
+        names.setdefault(os.path.basename(file).lower(), file)
+    pattern = re.compile(
+        "|".join(
+            [re.escape(name) for name in sorted(names, key=len, reverse=True)]
+            + [LINE_REF_PATTERN.pattern]
+        ),
+        re.IGNORECASE,
+    )
+    refs, file = [], None
+    for match in pattern.finditer(text):
+        if match.group(1) is None:
+            file = names[match.group(0).lower()]
+        else:
+            refs.append((file, int(match.group(1))))
+    return refs
+
+
+def summarise(query: str, answer: str) -> str:
+    """A one line reminder of an exchange, made without another request"""
+    first = re.split(r"(?<=[.!?])\s", answer.strip(), maxsplit=1)[0]
+    if len(first) > SUMMARY_CHARS:
+        first = first[:SUMMARY_CHARS].rstrip() + "..."
+    return f"- Asked: {query.strip()}\n  Answered: {first}"
+
+
+class History:
+    """The conversation about one reviewed chunk, built afresh for each
+    follow-up query so the tokens sent stay under `max_tokens`.
+
+    Each query is sent with the review, the latest `keep_turns` exchanges
+    verbatim, a summary of older ones, and only the lines of the chunk that
+    the query, the exchanges or the review refer to.
+    `opening` turns the first message into the messages that start the
+    conversation, e.g. with the instructions of the review's mode.
+    """
+
+    def __init__(
+        self,
+        intro: str,
+        chunk: str,
+        feedback: str,
+        model: str,
+        max_tokens: int = QUERY_TOKENS,
+        keep_turns: int = KEEP_TURNS,
+        opening: Optional[Callable[[str], List[dict]]] = None,
+    ):
+        self.intro = intro
+        self.opening = opening or (
+            lambda content: [{"role": "user", "content": content}]
+        )
+        self.feedback = feedback
+        self.model = model
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.turns: List[Tuple[str, str]] = []
+        # (file, line number, text) of each numbered line of the chunk
+        self.lines = [
+            (file, line_no, f"L{line_no}\t{text}\n")
+            for (file, line_no), text in parse_chunk(chunk).items()
+        ]
+        self.files = sorted({file for file, _, _ in self.lines if file})
+        # the files that the review refers to each line number in
+        self.review_files: Dict[int, Set[str]] = {}
+        for file, line_no in line_refs(feedback, self.files):
+            if file is not None:
+                self.review_files.setdefault(line_no, set()).add(file)
+
+    def add(self, query: str, answer: str):
+        self.turns.append((query, answer))
+
+    def build(self, query: str, summaries: List[str], recent, lines: str):
+        context = self.intro
+        if lines:
+            context += f"\n\n{lines}"
+        if summaries:
+            context += "\n\nEarlier in this conversation:\n" + "\n".join(summaries)
+        messages = self.opening(context)
+        messages.append({"role": "assistant", "content": self.feedback})
+        for old_query, answer in recent:
+            messages.append({"role": "user", "content": old_query})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": query})
+        return messages
+
+    def refs(self, text: str) -> List[Ref]:
+        """The lines mentioned in `text`, in the file it names, or else the
+        file the review mentions the line in, if there's just one"""
+        refs = []
+        for file, line_no in line_refs(text, self.files):
+            review_files = self.review_files.get(line_no, set())
+            if file is None and len(review_files) == 1:
+                file = next(iter(review_files))
+            refs.append((file, line_no))
+        return refs
+
+    def select_lines(self, refs: List[Ref], budget: int) -> str:
+        """The lines around `refs`, in order of priority, that fit in `budget`
+        tokens, as numbered text in chunk order"""
+        chosen, files = set(), set()
+        tokens = 1  # the blank line before them
+        for ref_file, ref in dict.fromkeys(refs):
+            for i, (file, line_no, text) in enumerate(self.lines):
+                if i in chosen or abs(line_no - ref) > CONTEXT_LINES:
+                    continue
+                if ref_file is not None and file != ref_file:
+                    continue
+                cost = count_tokens(text, self.model) + 1  # room for a "..."
+                if file not in files:
+                    cost += count_tokens(f"[started {file}]\n", self.model)
+                if tokens + cost > budget:
+                    break
+                chosen.add(i)
+                files.add(file)
+                tokens += cost
+
+        text = []
+        file, previous = None, None
+        for i in sorted(chosen):
+            line_file = self.lines[i][0]
+            if line_file != file:
+                text.append(f"[started {line_file}]\n")
+                file = line_file
+            elif previous is not None and i != previous + 1:
+                text.append("...\n")
+            text.append(self.lines[i][2])
+            previous = i
+        return "".join(text).strip()
+
+    def messages(self, query: str):
+        """The messages to send for `query`"""
+        older = self.turns[: max(0, len(self.turns) - self.keep_turns)]
+        recent = self.turns[len(older) :]
+        summaries = [summarise(q, a) for q, a in older]
+
+        # make room for the query by dropping the oldest exchanges first
+        while True:
+            fixed = count_message_tokens(self.build(query, [], recent, ""), self.model)
+            if fixed <= self.max_tokens or not recent:
+                break
+            summaries.append(summarise(*recent[0]))
+            recent = recent[1:]
+
+        # the lines the query is about come before reminders of older exchanges
+        query_lines = self.select_lines(self.refs(query), self.max_tokens - fixed)
+        budget = self.max_tokens - fixed - count_tokens(query_lines, self.model)
+        kept = []
+        for summary in reversed(summaries):
+            budget -= count_tokens(summary, self.model) + 1
+            if budget < 0:
+                break
+            kept.insert(0, summary)
+        if kept:
+            fixed = count_message_tokens(
+                self.build(query, kept, recent, ""), self.model
+            )
+
+        refs = self.refs(query)
+        for old_query, answer in reversed(recent):
+            refs += self.refs(old_query) + self.refs(answer)
+        refs += self.refs("\n".join(kept)) + line_refs(self.feedback, self.files)
+        lines = self.select_lines(refs, self.max_tokens - fixed)
+        return self.build(query, kept, recent, lines)
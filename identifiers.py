@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# the kinds of identifier, with how they are described to the user
+KINDS = {
+    "doi": "DOI",
+    "arxiv": "arXiv ID",
+    "isbn": "ISBN",
+    "title": "title",
+}
+
+DOI_PATTERN = re.compile(r"\b(10\.\d{4,9}/\S+)")
+# arXiv assigns DOIs to its papers too, which we treat as arXiv IDs
+ARXIV_DOI_PATTERN = re.compile(r"^10\.48550/arxiv\.(.+)$", re.IGNORECASE)
+
+# e.g. 2112.82302v2, or hep-th/9901001 and math.AG/0101001 from before 2007
+ARXIV_ID = r"(\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[a-z]{2})?/\d{7})(?:v\d+)?"
+ARXIV_ID_PATTERN = re.compile(rf"^{ARXIV_ID}$", re.IGNORECASE)
+ARXIV_JOURNAL_PATTERN = re.compile(
+    rf"(?:arXiv:\s*|abs/){ARXIV_ID}(?!\w)", re.IGNORECASE
+)
+ARXIV_URL_PATTERN = re.compile(
+    rf"arxiv\.org/(?:abs|pdf)/{ARXIV_ID}(?!\w)", re.IGNORECASE
+)
+OLD_SUBJECT_CLASS = re.compile(r"^([a-z\-]+)\.[a-z]{2}/", re.IGNORECASE)
+# entry types that an ISBN identifies, rather than the volume they are in
+BOOK_TYPES = {
+    "book",
+    "mvbook",
+    "booklet",
+    "collection",
+    "mvcollection",
+    "proceedings",
+    "mvproceedings",
+    "manual",
+    "reference",
+    "mvreference",
+}
+
+
+def canonical_arxiv_id(arxiv_id: str) -> str:
+    """Drop the version, and the subject class of old-style IDs, which
+    arXiv's API doesn't accept"""
+    arxiv_id = ARXIV_ID_PATTERN.match(arxiv_id).group(1)
+    return OLD_SUBJECT_CLASS.sub(r"\1/", arxiv_id).lower()
+
+
+def extract_doi(entry: dict) -> Optional[str]:
+    for field in ["doi", "url"]:
+        match = DOI_PATTERN.search(entry.get(field, ""))
+        if match:
+            return match.group(1).rstrip(".,;").lower()
+    return None
+
+
+def extract_arxiv_id(entry: dict) -> Optional[str]:
+    """The version-less arXiv ID of an entry, from whichever of its fields
+    give one"""
+    eprint = re.sub(r"^arxiv:\s*", "", entry.get("eprint", "").strip(), flags=re.I)
+    archive = entry.get("archiveprefix", entry.get("eprinttype", "arxiv"))
+    if archive.lower() == "arxiv" and ARXIV_ID_PATTERN.match(eprint):
+        return canonical_arxiv_id(eprint)
+
+    journal = entry.get("journal", "")
+    if "arxiv" in journal.lower() or "corr" in journal.lower():
+        match = ARXIV_JOURNAL_PATTERN.search(journal)
+        if match:
+            return canonical_arxiv_id(match.group(1))
+
+    match = ARXIV_URL_PATTERN.search(entry.get("url", ""))
+    if match:
+        return canonical_arxiv_id(match.group(1))
+
+    match = ARXIV_DOI_PATTERN.match(entry.get("doi", "").strip())
+    if match and ARXIV_ID_PATTERN.match(match.group(1)):
+        return canonical_arxiv_id(match.group(1))
+    return None
+
+
+def extract_isbn(entry: dict) -> Optional[str]:
+    """The entry's ISBN, in its 13 digit form, if it's a whole book"""
+    if entry.get("ENTRYTYPE", "").lower() not in BOOK_TYPES:
+        return None  # e.g. papers in the same proceedings share its ISBN
+    isbn = re.sub(r"[\s-]", "", entry.get("isbn", "")).upper()
+    if re.fullmatch(r"\d{9}[\dX]", isbn):
+        digits = "978" + isbn[:9]
+        checksum = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+        return digits + str(-checksum % 10)
+    if re.fullmatch(r"\d{13}", isbn):
+        return isbn
+    return None
+
+
+def canonical_title(entry: dict) -> Optional[str]:
+    """Lower case title, without LaTeX braces, punctuation or extra spaces"""
+    # drop commands and accents, e.g. \emph{Deep} and M\"{u}ller
+    title = re.sub(r"\\(?:[a-zA-Z]+\s*|\W)|[{}]", "", entry.get("title", "")).lower()
+    return " ".join(re.sub(r"[\W_]+", " ", title).split()) or None
+
+
+EXTRACTORS = {
+    "doi": extract_doi,
+    "arxiv": extract_arxiv_id,
+    "isbn": extract_isbn,
+    "title": canonical_title,
+}
+
+
+def identifiers(entry: dict) -> Dict[str, str]:
+    """Every identifier found in an entry, by kind"""
+    found = {}
+    for kind, extract in EXTRACTORS.items():
+        value = extract(entry)
+        if value is not None:
+            found[kind] = value
+    return found
+
+
+def build_identifier_index(
+    entry_identifiers: Iterable[Dict[str, str]],
+) -> Dict[str, Dict[str, List[int]]]:
+    """Map each kind of identifier, and each value of it, to the positions of
+    the entries that have it"""
+    index = {kind: defaultdict(list) for kind in KINDS}
+    for i, found in enumerate(entry_identifiers):
+        for kind, value in found.items():
+            index[kind][value].append(i)
+    return index
+
+
+def exact_duplicate_pairs(
+    entry_identifiers: Iterable[Dict[str, str]],
+) -> Dict[Tuple[int, int], str]:
+    """Position pairs `(i, j)`, with `i < j`, of entries sharing an identifier,
+    mapped to the first kind of identifier they share.
+
+    Each entry is paired with the first entry sharing the identifier, rather
+    than with every other one, so this is a single O(n) pass over hash
+    indexes, unlike `dupe_check`'s fuzzy matching.
+    """
+    pairs = {}
+    for kind, values in build_identifier_index(entry_identifiers).items():
+        for positions in values.values():
+            for j in positions[1:]:
+                pairs.setdefault((positions[0], j), kind)
+    return pairs
+
+
+def exact_groups(pairs: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """Map the position of each entry in `pairs` to the first position of
+    the group of entries that are exact duplicates of each other"""
+    groups = {}
+
+    def find(i):
+        while groups.setdefault(i, i) != i:
+            groups[i] = groups[groups[i]]
+            i = groups[i]
+        return i
+
+    for i, j in pairs:
+        a, b = find(i), find(j)
+        groups[max(a, b)] = min(a, b)
+    return {i: find(i) for i in list(groups)}
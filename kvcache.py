@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+from typing import Any, Dict, Iterable, Optional
+from bib_loader import cache_dir
+
+
+class Cache:
+    """A persistent JSON key-value store, backed by SQLite.
+
+    Each tool uses its own `namespace` in a shared database.
+    Values older than `ttl` seconds are treated as missing, and once a
+    namespace holds more than `max_entries` values the least recently
+    used ones are evicted.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        path: Optional[os.PathLike] = None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if path is None:
+            path = os.path.join(cache_dir(), "cache.sqlite")
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )""")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed)"
+        )
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+    def _fresh_since(self) -> float:
+        return time.time() - self.ttl if self.ttl is not None else float("-inf")
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Cached values for whichever of `keys` are present and fresh"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        # stay under SQLite's limit on query parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            rows = self.db.execute(
+                f"""SELECT key, value FROM cache
+                WHERE namespace = ? AND created >= ?
+                AND key IN ({", ".join("?" * len(batch))})""",
+                (self.namespace, self._fresh_since(), *batch),
+            )
+            found.update((key, json.loads(value)) for key, value in rows)
+        now = time.time()
+        self.db.executemany(
+            "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+            [(now, self.namespace, key) for key in found],
+        )
+        self.db.commit()
+        return found
+
+    def get(self, key: str, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items: Dict[str, Any]):
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+            [
+                (self.namespace, key, json.dumps(value), now, now)
+                for key, value in items.items()
+            ],
+        )
+        self.db.commit()
+
+    def set(self, key: str, value: Any):
+        self.set_many({key: value})
+
+    def delete(self, key: str):
+        self.db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+        self.db.commit()
+
+    def evict(self):
+        """Drop stale values, then the least recently used beyond the cap"""
+        self.db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND created < ?",
+            (self.namespace, self._fresh_since()),
+        )
+        if self.max_entries is not None:
+            self.db.execute(
+                """DELETE FROM cache WHERE namespace = ? AND key NOT IN (
+                    SELECT key FROM cache WHERE namespace = ?
+                    ORDER BY accessed DESC LIMIT ?
+                )""",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+        self.db.commit()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Type
+from bib_loader import SourceEntry, cache_dir, entry_hash, iter_entries
+import name_check
+import capital_check
+import dupe_check
+from arXiv_auto_check import comment_checker
+from identifiers import (
+    exact_duplicate_pairs,
+    exact_groups,
+    extract_arxiv_id,
+    identifiers,
+)
+from arxiv_lookup import fetch_papers
+from verified import VerificationStore
+
+# bump when the state layout changes, so old state files are ignored
+STATE_VERSION = 1
+
+
+class Diagnostic(NamedTuple):
+    rule: str
+    key: str  # citekey of the entry the diagnostic is about
+    message: str
+    line: Optional[int] = None  # where the entry starts in the bib file
+
+
+class Rule:
+    """A check run over the bibliography in a single pass.
+
+    `check_entry` is called once for each entry, in file order, and
+    `finish` once all entries have been seen, for checks that need the
+    whole bibliography (e.g. duplicates).
+    Rules are built from the command line options by `from_args`.
+
+    In incremental runs, the diagnostics of `entry_local` rules are replayed
+    for entries whose contents haven't changed, and `check_entry` is only
+    called for the rest.
+    Other rules see every entry, and can use `restore` and `save` to carry
+    their own state between runs.
+    """
+
+    name: str = ""
+    # diagnostics only depend on the entry they are about
+    entry_local: bool = True
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "Rule":
+        return cls()
+
+    def start(self):
+        """Called before each run, to reset any per-run state"""
+
+    def check_entry(self, entry: dict) -> Iterable[Diagnostic]:
+        return ()
+
+    def finish(self) -> Iterable[Diagnostic]:
+        return ()
+
+    def diagnostic(self, key: str, message: str) -> Diagnostic:
+        return Diagnostic(self.name, key, message)
+
+    def fingerprint(self) -> str:
+        """Identifies the rule's configuration, previous results are only
+        reused if this matches"""
+        return self.name
+
+    def restore(self, data: Any, changed: Set[str]):
+        """Load the state saved by the previous run, before `finish`.
+        `changed` holds the citekeys that were added or modified since."""
+
+    def save(self) -> Any:
+        """JSON-able state to pass to `restore` in the next run"""
+        return None
+
+
+RULES: Dict[str, Type[Rule]] = {}
+
+
+def stale_note(rule: Rule, entry: dict) -> str:
+    if rule.store.is_stale(rule.name, entry):
+        return " (changed since it was verified)"
+    return ""
+
+
+def register_rule(cls: Type[Rule]) -> Type[Rule]:
+    RULES[cls.name] = cls
+    return cls
+
+
+@register_rule
+class AuthorInitialsRule(Rule):
+    name = "names"
+
+    def check_entry(self, entry):
+        for author in name_check.entry_issues(entry):
+            yield self.diagnostic(
+                entry["ID"], f"Author {author} only includes initial for first name."
+            )
+
+
+@register_rule
+class CapitalizationRule(Rule):
+    name = "capitals"
+
+    def __init__(self, store: Optional[VerificationStore] = None):
+        self.store = store if store is not None else VerificationStore()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(store=args.store)
+
+    def fingerprint(self):
+        return f"{self.name}:{self.store.fingerprint(self.name)}"
+
+    def check_entry(self, entry):
+        if self.store.is_verified(self.name, entry):
+            return
+        for issue in capital_check.entry_issues(entry):
+            yield self.diagnostic(entry["ID"], issue + stale_note(self, entry))
+
+
+@register_rule
+class ArxivRule(Rule):
+    """Lists arXiv entries that haven't been verified as arXiv-only.
+
+    With `online` set, the entries are looked up on arXiv instead, and only
+    the ones that look like they have been published are reported.
+    """
+
+    name = "arxiv"
+
+    def __init__(
+        self,
+        store: Optional[VerificationStore] = None,
+        online=False,
+        **fetch_options,
+    ):
+        self.store = store if store is not None else VerificationStore()
+        self.online = online
+        self.fetch_options = fetch_options  # passed on to `fetch_papers`
+        self.start()
+
+    @classmethod
+    def from_args(cls, args):
+        if not args.online:
+            return cls(store=args.store)
+        return cls(
+            store=args.store,
+            online=True,
+            cache=args.cache,
+            refresh=args.refresh,
+            client=args.client,
+        )
+
+    def fingerprint(self):
+        return f"{self.name}:{self.online}:{self.store.fingerprint(self.name)}"
+
+    def start(self):
+        self.arxiv_entries = []
+
+    def check_entry(self, entry):
+        arxiv_id = extract_arxiv_id(entry)
+        if arxiv_id and not self.store.is_verified(self.name, entry):
+            if self.online:
+                self.arxiv_entries.append((entry["ID"], arxiv_id))
+            else:
+                yield self.diagnostic(
+                    entry["ID"],
+                    f"arXiv preprint {arxiv_id}, is it published?"
+                    + stale_note(self, entry),
+                )
+
+    def finish(self):
+        if not self.arxiv_entries:
+            return
+        papers = fetch_papers(
+            (arxiv_id for _, arxiv_id in self.arxiv_entries), **self.fetch_options
+        )
+        for key, arxiv_id in self.arxiv_entries:
+            paper = papers.get(arxiv_id)
+            if paper is None:
+                yield self.diagnostic(key, f"arXiv ID {arxiv_id} not found on arXiv")
+            elif paper.doi or comment_checker(paper.comment):
+                yield self.diagnostic(
+                    key,
+                    f"arXiv preprint may be published: {paper.links[0]}, "
+                    + f"{paper.comment}, doi: {paper.doi}",
+                )
+
+
+@register_rule
+class DuplicatesRule(Rule):
+    """Reports possible duplicates, see `dupe_check`.
+
+    Entries sharing a DOI, arXiv ID, ISBN or title are reported as exact
+    duplicates, before the fuzzy matching.
+    Incremental runs only score the pairs involving changed entries, and
+    keep the previous run's pairs between unchanged entries.
+    When the rule is reused between runs (e.g. in watch mode), its blocking
+    index stays in memory, and only changed entries are re-indexed.
+    """
+
+    name = "duplicates"
+    entry_local = False
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.pairs = []
+        self.index = None
+        self.keys = {}  # citekey of each id in `index`
+        self.next_id = 0
+        self.identifiers = {}  # by citekey
+        self.start()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(jobs=args.jobs)
+
+    def start(self):
+        self.entries = []
+        self.previous_pairs = []
+        self.changed = None
+
+    def check_entry(self, entry):
+        self.entries.append(entry)
+        return ()
+
+    def restore(self, data, changed):
+        self.previous_pairs = data or []
+        self.changed = changed
+
+    def save(self):
+        return self.pairs
+
+    def update_index(self):
+        """Index the entries that changed, returning their ids"""
+        present = {entry["ID"] for entry in self.entries}
+        for idx, key in list(self.keys.items()):
+            if key in self.changed or key not in present:
+                dupe_check.remove_from_index(self.index, idx)
+                del self.keys[idx]
+
+        changed_ids = set()
+        for entry in self.entries:
+            title = dupe_check.normalize_title(entry.get("title", ""))
+            if entry["ID"] in self.changed and title:
+                authors = dupe_check.parse_authors(entry)
+                dupe_check.add_to_index(self.index, self.next_id, title, authors)
+                self.keys[self.next_id] = entry["ID"]
+                changed_ids.add(self.next_id)
+                self.next_id += 1
+        return changed_ids
+
+    def update_identifiers(self):
+        """The identifiers of each entry, only extracting those of changed
+        entries again"""
+        found = {}
+        for entry in self.entries:
+            key = entry["ID"]
+            if (
+                self.changed is None
+                or key in self.changed
+                or key not in self.identifiers
+            ):
+                found[key] = identifiers(entry)
+            else:
+                found[key] = self.identifiers[key]
+        self.identifiers = found
+        return [found[entry["ID"]] for entry in self.entries]
+
+    def finish(self):
+        if self.changed is not None and self.index is not None:
+            changed_ids = self.update_index()
+        else:
+            self.index = dupe_check.index_entries(self.entries)
+            self.keys = {i: entry["ID"] for i, entry in enumerate(self.entries)}
+            self.next_id = len(self.entries)
+            changed_ids = None
+            if self.changed is not None:
+                changed_ids = {i for i, k in self.keys.items() if k in self.changed}
+
+        positions = {}
+        for i, entry in enumerate(self.entries):
+            positions.setdefault(entry["ID"], i)
+        # the position of each id in `index`, matched up in order as
+        # citekeys can repeat
+        ids_by_key = defaultdict(list)
+        for idx, key in sorted(self.keys.items(), reverse=True):
+            ids_by_key[key].append(idx)
+        id_positions = {}
+        for i, entry in enumerate(self.entries):
+            if ids_by_key[entry["ID"]]:
+                id_positions[ids_by_key[entry["ID"]].pop()] = i
+        position_ids = {i: idx for idx, i in id_positions.items()}
+
+        # exact duplicates are reported as such, so aren't scored
+        exact = exact_duplicate_pairs(self.update_identifiers())
+        groups = exact_groups(exact)
+        id_groups = {
+            position_ids[i]: position_ids[group]
+            for i, group in groups.items()
+            if i in position_ids and group in position_ids
+        }
+
+        pairs, ordered = set(), set()
+        if self.changed is not None:
+            for key1, key2 in self.previous_pairs:
+                if key1 in self.changed or key2 in self.changed:
+                    continue  # edited, so scored again below
+                if key1 in positions and key2 in positions:
+                    pairs.add((key1, key2))  # neither was removed
+                    ordered.add((positions[key1], positions[key2]))
+        scored = dupe_check.score_index(
+            self.index, self.jobs, changed=changed_ids, groups=id_groups
+        )
+        for i, j in scored:
+            pairs.add((self.keys[i], self.keys[j]))
+            if i in id_positions and j in id_positions:
+                ordered.add((id_positions[i], id_positions[j]))
+        self.pairs = sorted(pairs)
+
+        for key, messages in dupe_check.group_exact_pairs(self.entries, exact).items():
+            for message in messages:
+                yield self.diagnostic(key, message)
+
+        # report in file order
+        ordered = [
+            (min(i, j), max(i, j))
+            for i, j in ordered
+            if i != j and (i not in groups or groups[i] != groups.get(j))
+        ]
+        duplicates = dupe_check.group_pairs(self.entries, ordered)
+        for key, others in duplicates.items():
+            yield self.diagnostic(key, f"could be duplicated by {', '.join(others)}")
+
+
+def run_rules(
+    source_entries: Iterable[SourceEntry],
+    rules: List[Rule],
+    state: Optional[dict] = None,
+) -> List[Diagnostic]:
+    """Walk the entries once, dispatching each to every rule.
+
+    `state` is the previous run's state, which is updated in place.
+    When given, entries whose content hash is unchanged get their previous
+    diagnostics replayed, rather than being checked again.
+    Returns the diagnostics of all rules, ordered by where their entry is.
+    """
+    if state is None or state.get("version") != STATE_VERSION:
+        previous = {"entries": {}, "rules": {}}
+    else:
+        previous = state
+
+    # previous results that are still valid for each rule
+    cached = {}
+    for rule in rules:
+        rule.start()
+        rule_state = previous["rules"].get(rule.name)
+        if rule_state and rule_state["fingerprint"] == rule.fingerprint():
+            cached[rule.name] = rule_state
+
+    hashes = {}
+    lines = {}
+    diagnostics = []
+    for entry, offset, line in source_entries:
+        key = entry["ID"]
+        hashes[key] = entry_hash(entry)
+        lines.setdefault(key, line)
+        unchanged = previous["entries"].get(key) == hashes[key]
+        for rule in rules:
+            if rule.entry_local and unchanged and rule.name in cached:
+                for message in cached[rule.name]["diagnostics"].get(key, []):
+                    diagnostics.append(rule.diagnostic(key, message))
+            else:
+                diagnostics.extend(rule.check_entry(entry))
+
+    changed = {k for k, h in hashes.items() if previous["entries"].get(k) != h}
+    for rule in rules:
+        if rule.name in cached:
+            rule.restore(cached[rule.name]["data"], changed)
+        diagnostics.extend(rule.finish())
+
+    if state is not None:
+        by_rule = defaultdict(lambda: defaultdict(list))
+        for d in diagnostics:
+            by_rule[d.rule][d.key].append(d.message)
+        state.clear()
+        state["version"] = STATE_VERSION
+        state["entries"] = hashes
+        state["rules"] = {
+            rule.name: {
+                "fingerprint": rule.fingerprint(),
+                "diagnostics": by_rule[rule.name],
+                "data": rule.save(),
+            }
+            for rule in rules
+        }
+
+    diagnostics = [d._replace(line=lines.get(d.key)) for d in diagnostics]
+    diagnostics.sort(key=lambda d: d.line or 0)
+    return diagnostics
+
+
+def state_path(filename: os.PathLike) -> str:
+    """Where the incremental state for a bib file is kept"""
+    name = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_dir("state"), f"{name}.json")
+
+
+def load_state(path: os.PathLike) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path: os.PathLike, state: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def check(
+    filename: os.PathLike, rules: List[Rule], incremental: bool = False
+) -> List[Diagnostic]:
+    """Run `rules` over a bib file.
+
+    With `incremental` set, the per-entry content hashes and results are
+    kept between runs, so only added or modified entries are checked again.
+    """
+    if not incremental:
+        return run_rules(iter_entries(filename), rules)
+
+    path = state_path(filename)
+    state = load_state(path)
+    diagnostics = run_rules(iter_entries(filename), rules, state)
+    save_state(path, state)
+    return diagnostics
+
+
+def format_diagnostic(filename: os.PathLike, diagnostic: Diagnostic) -> str:
+    return (
+        f"{filename}:{diagnostic.line}: [{diagnostic.rule}] "
+        + f"{diagnostic.key}: {diagnostic.message}"
+    )
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+import abc
+import re
+import json
+import time
+import random
+import argparse
+import openai
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional
+from telemetry import Telemetry
+from tokens import count_message_tokens, count_tokens
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+
+# errors worth waiting out, rather than problems with the request itself
+OPENAI_RETRY_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+)
+
+Messages = List[Dict[str, str]]
+OnText = Optional[Callable[[str], None]]
+
+
+class Completion(NamedTuple):
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class RetryableError(Exception):
+    """A failure worth waiting out, e.g. being rate limited"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, unless the server said how long"""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class Backend(abc.ABC):
+    """Somewhere to send chat prompts.
+
+    Subclasses implement `stream`, which passes the reply to `on_text` piece
+    by piece as it is generated, and raise `RetryableError` for failures
+    that are worth retrying.
+    """
+
+    max_retries = MAX_RETRIES
+    telemetry: Optional[Telemetry] = None
+
+    @abc.abstractmethod
+    def stream(
+        self,
+        model: str,
+        messages: Messages,
+        max_tokens: Optional[int] = None,
+        on_text: OnText = None,
+    ) -> Completion:
+        pass
+
+    def complete(
+        self,
+        model: str,
+        messages: Messages,
+        max_tokens: Optional[int] = None,
+        on_text: OnText = None,
+    ) -> Completion:
+        """`stream`, retrying with exponential backoff until some of the reply
+        has been passed on, and recording the request to `telemetry`"""
+        started, start = time.time(), time.perf_counter()
+        first_token = None
+        for attempt in range(self.max_retries + 1):
+            received = []
+
+            def collect(text):
+                nonlocal first_token
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                received.append(text)
+                if on_text is not None:
+                    on_text(text)
+
+            try:
+                completion = self.stream(model, messages, max_tokens, collect)
+            except Exception as e:
+                if isinstance(e, RetryableError) and not (
+                    received or attempt == self.max_retries
+                ):
+                    time.sleep(backoff_delay(attempt, e.retry_after))
+                    continue
+                if self.telemetry is not None:
+                    self.telemetry.record(
+                        model,
+                        started,
+                        time.perf_counter() - start,
+                        first_token,
+                        retries=attempt,
+                        error=type(e).__name__,
+                    )
+                raise
+            if self.telemetry is not None:
+                self.telemetry.record(
+                    model,
+                    started,
+                    time.perf_counter() - start,
+                    first_token,
+                    completion.prompt_tokens,
+                    completion.completion_tokens,
+                    retries=attempt,
+                )
+            return completion
+
+
+class OpenAIBackend(Backend):
+    """The OpenAI chat completions API, or a server compatible with it (e.g.
+    a local model) at `api_base`"""
+
+    def __init__(
+        self, api_base: Optional[str] = None, api_key: Optional[str] = None, **options
+    ):
+        """`options` are passed on with each request, e.g. `temperature`"""
+        self.options = options
+        if api_base is not None:
+            self.options["api_base"] = api_base
+        if api_key is not None:
+            self.options["api_key"] = api_key
+
+    def stream(self, model, messages, max_tokens=None, on_text=None):
+        options = dict(self.options)
+        if max_tokens is not None:
+            options["max_tokens"] = max_tokens
+        text = []
+        try:
+            response = openai.ChatCompletion.create(
+                model=model, messages=messages, stream=True, **options
+            )
+            for chunk in response:
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content:
+                    text.append(content)
+                    if on_text is not None:
+                        on_text(content)
+        except OPENAI_RETRY_ERRORS as e:
+            retry_after = (e.headers or {}).get("Retry-After")
+            if retry_after is not None and not retry_after.isdigit():
+                retry_after = None
+            raise RetryableError(str(e), retry_after and float(retry_after)) from e
+
+        # streamed replies don't include usage, so count the tokens ourselves
+        text = "".join(text)
+        return Completion(
+            text, count_message_tokens(messages, model), count_tokens(text, model)
+        )
+
+
+class StubBackend(Backend):
+    """Canned replies, for trying out the tools offline.
+
+    Replies comment on every `every`th numbered line (`L<n>`) of the prompt,
+    in the format reviewer_2 asks for, after `latency` seconds and then one
+    word every `word_delay` seconds.
+    A fraction `error_rate` of requests fail as if rate limited.
+    """
+
+    def __init__(self, latency=0.0, word_delay=0.0, error_rate=0.0, every=10):
+        self.latency = latency
+        self.word_delay = word_delay
+        self.error_rate = error_rate
+        self.every = every
+
+    def reply(self, messages: Messages) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        lines = []
+        for match in re.finditer(r"^\[started (\S+?),.*$|^L(\d+)\t", prompt, re.M):
+            if match.group(1):
+                lines.append(f"[reviewing file: `{match.group(1)}`]")
+            elif int(match.group(2)) % self.every == 0:
+                lines.append(
+                    f"- L{match.group(2)}: Consider splitting this sentence, "
+                    + "it is quite long."
+                )
+        return "\n".join(lines) or "No comments, this looks fine."
+
+    def rate_limit(self):
+        if random.random() < self.error_rate:
+            raise RetryableError("stub rate limit", retry_after=0)
+
+    def stream(self, model, messages, max_tokens=None, on_text=None):
+        self.rate_limit()
+        return self.generate(model, messages, on_text)
+
+    def generate(self, model, messages, on_text=None):
+        time.sleep(self.latency)
+        text = self.reply(messages)
+        for word in re.findall(r"\S+\s*", text):
+            time.sleep(self.word_delay)
+            if on_text is not None:
+                on_text(word)
+        return Completion(
+            text, count_message_tokens(messages, model), count_tokens(text, model)
+        )
+
+
+BACKENDS = ["openai", "stub"]
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="openai",
+        help="Where to send prompts, `stub` gives canned replies for testing",
+    )
+    parser.add_argument(
+        "--api_base",
+        type=str,
+        default=None,
+        help="URL of an OpenAI compatible API, e.g. a local stub server",
+    )
+    parser.add_argument(
+        "--request_log",
+        type=str,
+        default=None,
+        help="JSONL file the tokens, latency and cost of each request are "
+        + "appended to, by default in ~/.cache/bib-boi",
+    )
+
+
+def open_backend(args: argparse.Namespace, tool: str) -> Backend:
+    if args.backend == "stub":
+        backend = StubBackend()
+    else:
+        backend = OpenAIBackend(api_base=args.api_base)
+    backend.telemetry = Telemetry(tool, args.request_log)
+    return backend
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves `StubBackend` replies over OpenAI's chat completions API"""
+
+    backend = StubBackend()
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = request.get("model", "stub")
+        try:
+            self.backend.rate_limit()
+        except RetryableError:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        if not request.get("stream"):
+            completion = self.backend.generate(model, request["messages"])
+            self.send_json(
+                {
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": completion.text,
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": completion.prompt_tokens,
+                        "completion_tokens": completion.completion_tokens,
+                        "total_tokens": completion.total_tokens,
+                    },
+                }
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.backend.generate(
+            model,
+            request["messages"],
+            on_text=lambda text: self.send_event(model, {"content": text}),
+        )
+        self.send_event(model, {}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def send_json(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, model, delta, finish_reason=None):
+        chunk = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass  # keep load tests quiet
+
+
+if __name__ == "__main__":
+    """Serve canned replies over an OpenAI compatible API, for testing the
+    LLM tools offline, e.g. with `reviewer_2.py --api_base
+    http://localhost:8000/v1`"""
+    parser = argparse.ArgumentParser(description="Run a stub LLM server")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="Seconds before replying"
+    )
+    parser.add_argument(
+        "--word_delay", type=float, default=0.01, help="Seconds between words"
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that fail as rate limited",
+    )
+    args = parser.parse_args()
+
+    StubHandler.backend = StubBackend(args.latency, args.word_delay, args.error_rate)
+    server = ThreadingHTTPServer(("localhost", args.port), StubHandler)
+    print(f"Serving stub completions on http://localhost:{args.port}/v1")
+    server.serve_forever()
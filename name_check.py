@@ -1,41 +1,31 @@
 #!/usr/bin/env python3
-import os
 import sys
-import bibtexparser
-from bibtexparser.bparser import BibTexParser
+from bib_loader import iter_entries
 
 
-def load_manual_data(path: os.PathLike):
-    checked_keys = []
+def entry_issues(entry):
+    """Yield the authors of an entry that only have an initial for a first name"""
+    try:
+        author = entry["author"]
+    except KeyError:
+        return  # Skip this entry if it doesn't have an author
 
-    if os.path.exists(path):
-        with open(path) as f:
-            while line := f.readline():
-                checked_keys.append(line.rstrip())
-    return checked_keys
+    authors = author.split(" and ")
 
+    for a in authors:
+        firstName = a.split(", ")[-1]  # Get the first name of the author.
+        if len(firstName) == 1 and firstName.isalpha():
+            yield a
 
-def find_issues(filename):
-    with open(filename) as bibtex_file:
-        parser = BibTexParser()
-        bib_database = bibtexparser.load(bibtex_file, parser=parser)
 
-    for i, entry in enumerate(bib_database.entries):
+def find_issues(filename):
+    for entry, offset, line in iter_entries(filename):
         key = entry["ID"]
-        try:
-            author = entry["author"]
-        except KeyError:
-            continue  # Skip this entry if it doesn't have an author
-
-        authors = author.split(" and ")
-
-        for a in authors:
-            firstName = a.split(", ")[-1]  # Get the first name of the author.
-            if len(firstName) == 1 and firstName.isalpha():
-                warning = (
-                    f"Warning! {key}: Author {a} only includes initial for first name."
-                )
-                print(warning)
+        for a in entry_issues(entry):
+            warning = (
+                f"Warning! {key}: Author {a} only includes initial for first name."
+            )
+            print(warning)
 
 
 if __name__ == "__main__":
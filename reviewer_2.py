@@ -1,27 +1,44 @@
 #!/usr/bin/env python3
-import openai
 import textwrap
 import argparse
 import warnings
 import os
-import re
-
-# import tiktoken
-
-
-# def estimate_tokens(string, model):
-#     enc = tiktoken.encoding_for_model(model)
-#     num_tokens = len(encoding.encode(string))
-#     return num_tokens
-
-
-def pricing(tokens, model):
-    prices = {"gpt-3.5-turbo-0301": 0.002}
-    if model not in prices:
-        raise ValueError(
-            "Unknown price for model, checking pricing chart here: https://openai.com/pricing"
-        )
-    return prices[model] * (tokens / 1000)
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from kvcache import Cache
+from llm_backend import add_backend_arguments, open_backend
+from feedback import (
+    check_item,
+    format_feedback,
+    merge_feedback,
+    parse_chunk,
+    parse_feedback,
+    validate_feedback,
+)
+from history import QUERY_TOKENS, History
+from tex_diff import changed_regions, repository
+from telemetry import estimate_cost, format_cost
+from tex_project import SourceLine, TexProject
+from tex_reduce import RULES, parse_rules, reduce_lines
+from tokens import (
+    CONTEXT_FILL,
+    RESPONSE_TOKENS,
+    chunk_budget,
+    count_message_tokens,
+    count_tokens,
+    pack,
+    windows,
+)
+
+DEFAULT_MODEL = "gpt-3.5-turbo-0301"
+
+# bump when the review prompt changes, so cached reviews aren't reused
+PROMPT_VERSION = 1
+CACHE_MAX_ENTRIES = 10_000
+# tokens repeated from the end of one request at the start of the next
+WINDOW_OVERLAP = 128
 
 
 def printwrap(string, max_width=80):
@@ -39,111 +56,42 @@ def printwrap(string, max_width=80):
     print(f"\t{text}")
 
 
-def read_tex_file(fname, start_line=0, max_tokens=4 * 1024):
-    # Read the content of the latex file
-    with open(fname, "r") as f:
-        lines = f.readlines()
-    text = f"[started: {fname}]"
-    tokens = 0  # use heuristic of 1 token per 3 characters
-    partial = False  # have we only read a subset of our file
-    for i, line in enumerate(lines[start_line:]):
-        line_no = i + start_line + 1
-        if line == "\n":
-            l = f"L{line_no}\t\n"
-        elif line.lstrip() == "":
-            continue
-        elif line.lstrip()[0] == "%":
-            continue  # don't include commented out text
-        else:
-            l = f"L{line_no}\t{line}\n"
-        text += l
-        tokens += len(l) // 3
-        if tokens > max_tokens:
-            partial = True
-            break
-    return text, line_no, partial
+def format_line(line_no, line):
+    """A line as sent to the model, or None for lines that are left out"""
+    if line == "\n":
+        return f"L{line_no}\t\n"
+    elif line.lstrip() == "":
+        return None
+    elif line.lstrip()[0] == "%":
+        return None  # don't include commented out text
+    return f"L{line_no}\t{line}\n"
 
 
-def read_tex_file_stack(fname_stack, max_tokens=4 * 1024):
-    """Recursively read TeX files that use \input"""
+class LinePrinter:
+    """Prints streamed text as `printwrap` would, a line at a time as each
+    line is finished"""
 
-    # cd so we are at tex project root dir
-    root_dir = os.path.dirname(fname_stack[0][0])
-    os.chdir(root_dir)
+    def __init__(self):
+        self.buffer = ""
 
-    stack_files = [f[0] for f in fname_stack]
+    def __call__(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            printwrap(line)
 
-    def read_file(fname, start_line, tokens, max_tokens):
-        with open(fname, "r") as f:
-            lines = f.readlines()
-        text = f"[started {fname}, start_line: {start_line}]\n"
-        partial = True
-        input_partial = False  # is our sub_file partially finished
-        line_no = 0
+    def flush(self):
+        if self.buffer:
+            printwrap(self.buffer)
+        self.buffer = ""
 
-        def _check_tokens():
-            """Helper function that checks if we have
-            used up our token budget."""
-            if tokens > max_tokens:
-                return True
-            else:
-                return False
-
-        for i, line in enumerate(lines[start_line:]):
-            line_no = i + start_line + 1
-
-            if line == "\n":
-                continue
-            elif line.lstrip() == "":
-                continue
-            elif line.lstrip()[0] == "%":
-                continue
-            elif input_match := re.match(r"\\input{(.*?)}", line):
-                # check if we are including a sub-file (walrus ftw)
-                input_fname = input_match.group(1)
-
-                if ".tex" not in input_fname:
-                    # add file extension if missing
-                    input_fname += ".tex"
-
-                fname_stack[-1] = (fname, line_no)  # save our previous place
-                # if input_fname in stack_files:
-                #     raise ValueError("{input_fname} already in stack", fname_stack)
-                fname_stack.append((input_fname, 0))  # add new file to stack
-
-                print("> reading subfile: ", input_fname)
-                input_text, input_tokens, input_partial, last_line = read_file(
-                    input_fname, 0, tokens, max_tokens
-                )
-                text += input_text
-                tokens += input_tokens
-            else:
-                l = f"L{line_no}\t{line}\n"
-                text += l
-                tokens += len(l) // 3
-
-            if _check_tokens():
-                break
-
-        # check if we have finished parsing the file
-        if line_no >= len(lines):
-            text += f"[finished {fname}]\n"
-            print(f"> processed {fname}", line_no, start_line, fname_stack)
-            fname_stack.pop()  # remove file from stack
-            partial = False
-        elif not input_partial:
-            # save our place, if we have no pending sub-files
-            fname_stack[-1] = (fname, line_no)
-        return text, tokens, partial, line_no
-
-    fname, start_line = fname_stack[-1]  # read the last item in the stack
-    text, tokens, partial, _ = read_file(fname, start_line, 200, max_tokens)
-    if len(fname_stack) == 0:
-        # we have processed the whole document
-        partial = False
-    else:
-        partial = True
-    return text, fname_stack, partial
+
+def stream_completion(backend, model, messages, max_tokens=None):
+    """Send `messages`, printing the reply as it arrives"""
+    printer = LinePrinter()
+    completion = backend.complete(model, messages, max_tokens, on_text=printer)
+    printer.flush()
+    return completion
 
 
 def continue_check():
@@ -160,14 +108,8 @@ def continue_check():
             print("You have to choose Yes or No or Query")
 
 
-def query_response(messages, query, model):
-    completion = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-    )
-    feedback = completion.choices[0].message.content
-    printwrap(feedback)
-    return feedback
+def query_response(backend, messages, model):
+    return stream_completion(backend, model, messages).text
 
 
 def mode_text(message, messages, mode):
@@ -201,25 +143,8 @@ def mode_text(message, messages, mode):
     return messages
 
 
-def generate_feedback(
-    fname,
-    model,
-    thesis_topic,
-    recurse_subfiles=False,
-    fname_stack=None,
-    start_line=0,
-    messages=[],
-    total_cost=0.0,
-    mode="default",
-):
-
-    if not recurse_subfiles:
-        text, final_line, partial = read_tex_file(fname, start_line)
-    else:
-        text, fname_stack, partial = read_tex_file_stack(fname_stack)
-        final_line = 0
-
-    message = f"""{text}
+def review_prompt(text, thesis_topic):
+    return f"""{text}
 
     The above is an exert from a thesis about {thesis_topic}.
     It may spans several LaTeX files, the start and end of a file are indicated
@@ -237,63 +162,472 @@ def generate_feedback(
     - L3: [feedback]
     etc
     """
-    messages = mode_text(message, messages, mode)
-    # print("debug:", text)
-    # num_tokens = estimate_tokens(text, model)
-    # print(f"Estimated {num_tokens} tokens")
-
-    completion = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
+
+
+def query_intro(thesis_topic):
+    return (
+        f"You reviewed an exert from a thesis about {thesis_topic}. "
+        + "The lines of it that we are discussing are below, "
+        + "with their line numbers."
+    )
+
+
+def review_key(text, model, thesis_topic, mode):
+    """Cache key for the review of a chunk of text"""
+    key = json.dumps([PROMPT_VERSION, model, mode, thesis_topic, text])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def open_cache(max_entries=CACHE_MAX_ENTRIES):
+    return Cache("review", max_entries=max_entries)
+
+
+def text_budget(
+    model,
+    thesis_topic,
+    mode="default",
+    fill=CONTEXT_FILL,
+    response_tokens=RESPONSE_TOKENS,
+):
+    """Tokens of LaTeX that fit in one review request"""
+    prompt = mode_text(review_prompt("", thesis_topic), [], mode)
+    return chunk_budget(
+        model, count_message_tokens(prompt, model), fill, response_tokens
     )
-    feedback = completion.choices[0].message.content
-    printwrap(feedback)
-    tokens = completion.usage.total_tokens
-    cost = pricing(tokens, model)
-    total_cost += cost
-    print()
-    print(f"We dealt with {tokens} tokens, around ${cost} (total: ${total_cost})")
-    if not recurse_subfiles:
-        print(f"final line was: {final_line} (done: {not partial})")
+
+
+def session_key(fname, model, thesis_topic, mode):
+    """Checkpoint key for an interactive review of `fname`"""
+    key = json.dumps([os.path.abspath(fname), model, mode, thesis_topic])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def open_sessions():
+    return Cache("session")
+
+
+def resume_index(checkpoint, keys):
+    """The first chunk that hasn't been reviewed in the checkpointed session"""
+    done = checkpoint["keys"]
+    for index, key in enumerate(keys):
+        if index == len(done) or done[index] != key:
+            break
     else:
-        print("post-run stack:", fname_stack)
-        if not len(fname_stack):
-            partial = True
-            stack_top = ("finished", "-1")
-        else:
-            stack_top = fname_stack[-1]
+        return len(keys)
+    if index < len(done):
+        warnings.warn(
+            "The document changed since the session was checkpointed, "
+            + f"resuming from the first part that changed ({index + 1})"
+        )
+    return index
+
+
+def generate_feedback(
+    chunks,
+    backend,
+    model,
+    thesis_topic,
+    mode="default",
+    response_tokens=RESPONSE_TOKENS,
+    cache=None,
+    refresh=False,
+    query_tokens=QUERY_TOKENS,
+    sessions=None,
+    session=None,
+    resume=False,
+    filter_feedback=False,
+):
+    """Review `chunks` one at a time, asking before moving on.
+
+    With `sessions`, a checkpoint is saved under `session` after every
+    chunk, and `resume` carries on from it without re-sending any chunk.
+    With `filter_feedback`, each review is also passed through a second
+    prompt that drops unhelpful comments.
+    """
+    keys = [review_key(text, model, thesis_topic, mode) for text in chunks]
+    checkpoint = {"keys": [], "feedback": [], "total_cost": 0.0}
+    saved = None if sessions is None else sessions.get(session)
+    if resume and saved is not None:
+        checkpoint = saved
+    elif resume:
+        print("No unfinished session to resume, starting from the beginning")
+    elif saved is not None:
+        print("Starting over, use --resume to carry on with the unfinished session")
+    start = resume_index(checkpoint, keys)
+    checkpoint["keys"] = checkpoint["keys"][:start]
+    checkpoint["feedback"] = checkpoint["feedback"][:start]
+    total_cost = checkpoint["total_cost"]
+    if start > 0:
         print(
-            f"final line was: {stack_top[0]}:L{stack_top[1]}"
-            + f" (done: {not partial}, stack_size: {len(fname_stack)})"
+            f"Resuming at part {start + 1} of {len(chunks)} "
+            + f"(spent {format_cost(total_cost)} so far)\n"
         )
 
-    cont, query = continue_check()
-    print("\n\n\n")
+    try:
+        for index in range(start, len(chunks)):
+            text = chunks[index]
+            messages = mode_text(review_prompt(text, thesis_topic), [], mode)
+
+            cached = None if cache is None or refresh else cache.get(keys[index])
+            if cached is not None:
+                feedback, tokens = cached["feedback"], 0
+                printwrap(feedback)
+            else:
+                completion = stream_completion(
+                    backend, model, messages, response_tokens
+                )
+                feedback, tokens = completion.text, completion.total_tokens
+                if cache is not None:
+                    cache.set(keys[index], {"feedback": feedback, "tokens": tokens})
+            print()
+            if cached is not None:
+                print(
+                    "Unchanged since the last review "
+                    + f"(total: {format_cost(total_cost)})"
+                )
+            else:
+                cost = estimate_cost(
+                    model, completion.prompt_tokens, completion.completion_tokens
+                )
+                if total_cost is not None:
+                    total_cost = None if cost is None else total_cost + cost
+                print(
+                    f"We dealt with {tokens} tokens, {format_cost(cost)} "
+                    + f"(total: {format_cost(total_cost)})"
+                )
+            print(f"Reviewed part {index + 1} of {len(chunks)}")
+
+            items, lines = check_review(feedback, text)
+            if filter_feedback and items:
+                (items,) = post_process(
+                    backend, [items], [lines], model, cache=cache, refresh=refresh
+                )
+                print("\nAfter filtering:")
+                printwrap(format_feedback(items) or "No comments left")
+
+            checkpoint["keys"].append(keys[index])
+            checkpoint["feedback"].append(feedback)
+            checkpoint["total_cost"] = total_cost
+            if sessions is not None:
+                sessions.set(session, checkpoint)
 
-    if not cont and query is not None:
-        while not cont and query is not None:
-            messages.append({"role": "assistant", "content": feedback})
-            messages.append({"role": "user", "content": query})
-            response = query_response(messages, query, model)
-            messages.append({"role": "assistant", "content": response})
             cont, query = continue_check()
+            print("\n\n\n")
+
+            # follow-up queries are sent with a capped amount of history, so
+            # they don't get slower and pricier the longer the conversation goes
+            history = History(
+                query_intro(thesis_topic),
+                text,
+                feedback,
+                model,
+                max_tokens=query_tokens,
+                opening=lambda content: mode_text(content, [], mode),
+            )
+            while not cont and query is not None:
+                response = query_response(backend, history.messages(query), model)
+                history.add(query, response)
+                cont, query = continue_check()
+    except BaseException:
+        if sessions is not None and len(checkpoint["keys"]) < len(chunks):
+            print(
+                f"\nStopped after part {len(checkpoint['keys'])} of {len(chunks)}, "
+                + "use --resume to carry on from there"
+            )
+        raise
+
+    print("Finished text")
+    if sessions is not None:
+        sessions.delete(session)
+
+
+def format_source_lines(source_lines):
+    """Line numbered text, marking where each file's lines start"""
+    text = []
+    file = None
+    for source_line in source_lines:
+        if source_line.file != file:
+            file = source_line.file
+            text.append(f"[started {file}, start_line: {source_line.line}]\n")
+        text.append(format_line(source_line.line, source_line.text))
+    return "".join(text)
+
+
+def split_document(
+    fname,
+    model,
+    recurse_subfiles=False,
+    start_line=0,
+    max_tokens=4 * 1024,
+    overlap=WINDOW_OVERLAP,
+    reduce_rules=tuple(RULES),
+):
+    """Read the whole document upfront, as the texts of successive requests.
+
+    The document is reviewed with a sliding window: each request repeats
+    up to `overlap` tokens from the end of the one before, so comments on
+    text at the boundaries aren't missed.
+    With `recurse_subfiles`, files included by `fname` are read in place.
+    Text that isn't prose, e.g. the preamble or figures, is left out or
+    replaced by a placeholder using `reduce_rules`, see `tex_reduce`.
+    """
+    project = TexProject(fname, recurse_subfiles, start_line)
+    source_lines = [
+        s
+        for s in reduce_lines(project.lines, reduce_rules)
+        if format_line(s.line, s.text) is not None
+    ]
+
+    counts = []
+    for i, source_line in enumerate(source_lines):
+        if i > 0 and source_line.file != source_lines[i - 1].file:
+            # with room for the marker of where the file starts
+            text = format_source_lines([source_line])
+        else:
+            text = format_line(source_line.line, source_line.text)
+        counts.append(count_tokens(text, model))
+    # lines that start a paragraph, where windows can start without overlap
+    breaks = [
+        i
+        for i, source_line in enumerate(source_lines)
+        if i == 0
+        or source_lines[i - 1].text.strip() == ""
+        or source_line.file != source_lines[i - 1].file
+    ]
+    header_tokens = count_tokens(format_source_lines(source_lines[:1]), model)
+    budget = max_tokens - header_tokens
+    return [
+        format_source_lines(source_lines[start:stop])
+        for start, stop in windows(counts, budget, overlap, breaks)
+    ]
+
+
+def diff_chunks(fname, ref, model, max_tokens=4 * 1024, reduce_rules=tuple(RULES)):
+    """The texts of requests covering only what changed since the git `ref`,
+    in `fname` or the files it inputs, with a paragraph of context"""
+    root_dir = os.path.dirname(os.path.abspath(fname))
+    pieces = []  # text and token count of each region
+    for path, regions in changed_regions(fname, ref).items():
+        with open(path) as f:
+            name = os.path.relpath(path, root_dir)
+            lines = [
+                SourceLine(name, line_no, line) for line_no, line in enumerate(f, 1)
+            ]
+        # reduced as a whole, as environments can start outside of a region
+        lines = {s.line: s.text for s in reduce_lines(lines, reduce_rules)}
+        for first, last in regions:
+            numbered = []
+            for line_no in range(first, last + 1):
+                l = (
+                    None
+                    if line_no not in lines
+                    else format_line(line_no, lines[line_no])
+                )
+                if l is not None:
+                    numbered.append((line_no, l))
+            counts = [count_tokens(l, model) for _, l in numbered]
+            # split regions that are too big for one request on their own
+            for start, stop in pack(counts, max_tokens):
+                header = f"[started {name}, start_line: {numbered[start][0]}]\n"
+                pieces.append(
+                    (
+                        header + "".join(l for _, l in numbered[start:stop]),
+                        count_tokens(header, model) + sum(counts[start:stop]),
+                    )
+                )
+
+    counts = [tokens for _, tokens in pieces]
+    return [
+        "".join(text for text, _ in pieces[start:stop])
+        for start, stop in pack(counts, max_tokens)
+    ]
+
+
+def complete_cached(
+    backend,
+    model,
+    requests,
+    max_tokens=None,
+    concurrency=4,
+    cache=None,
+    refresh=False,
+    action=None,
+):
+    """Replies to `requests`, a dict of cache key to messages, sending up to
+    `concurrency` at once. Replies are taken from `cache` where possible,
+    unless `refresh` is set, and cached otherwise.
+    With an `action`, e.g. "Reviewing", progress is shown."""
+    results = {}
+    if cache is not None and not refresh:
+        results = cache.get_many(requests)
+    if action is not None:
+        print(
+            f"{action} {len(requests) - len(results)} of {len(requests)} chunks, "
+            + f"{concurrency} at a time"
+        )
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = {
+            pool.submit(backend.complete, model, messages, max_tokens): key
+            for key, messages in requests.items()
+            if key not in results
+        }
+        for future in tqdm(
+            as_completed(futures), total=len(futures), disable=action is None
+        ):
+            completion = future.result()
+            result = {"feedback": completion.text, "tokens": completion.total_tokens}
+            results[futures[future]] = result
+            if cache is not None:
+                # only written from this thread, as SQLite connections can't
+                # be shared between threads
+                cache.set(futures[future], result)
+    return results
+
+
+def filter_prompt(items, lines):
+    excerpt = []
+    file = None
+    for item in merge_feedback(items):
+        if item.file != file:
+            excerpt.append(f"[started {item.file}]")
+            file = item.file
+        excerpt.append(f"L{item.line}\t{lines[(item.file, item.line)]}")
+    excerpt = "\n".join(dict.fromkeys(excerpt))
+    return f"""{excerpt}
+
+    The above are lines from a thesis, and below are review comments on them.
+
+    {format_feedback(items)}
+
+    Remove any comment that is wrong about the text, vague, only praise,
+    or otherwise unhelpful to the author.
+    Reply with the remaining comments exactly as they are, in the same format,
+    and nothing else.
+    """
+
+
+def filter_key(prompt, model):
+    """Cache key for the second pass over a review"""
+    key = json.dumps(["filter", PROMPT_VERSION, model, prompt])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def post_process(
+    backend, chunk_items, chunk_lines, model, concurrency=4, cache=None, refresh=False
+):
+    """Pass the comments on each chunk through a second prompt that drops
+    unhelpful ones. Only comments that survived `validate_feedback` are sent,
+    with just the lines they are about, so this pass is cheap."""
+    prompts = [
+        filter_prompt(items, lines) if items else None
+        for items, lines in zip(chunk_items, chunk_lines)
+    ]
+    keys = [None if p is None else filter_key(p, model) for p in prompts]
+    requests = {
+        key: [{"role": "user", "content": prompt}]
+        for key, prompt in zip(keys, prompts)
+        if prompt is not None
+    }
+    results = complete_cached(
+        backend,
+        model,
+        requests,
+        concurrency=concurrency,
+        cache=cache,
+        refresh=refresh,
+        action="Filtering" if len(requests) > 1 else None,
+    )
 
-    if not partial:
-        print("Finished text")
-        return
+    filtered = []
+    for key, lines in zip(keys, chunk_lines):
+        if key is None:
+            filtered.append([])
+            continue
+        items, _ = parse_feedback(results[key]["feedback"])
+        filtered.append(validate_feedback(items, lines)[0])
+    return filtered
+
+
+def check_review(feedback, chunk):
+    """The comments of a review that hold up against the chunk, noting those
+    that were moved or dropped"""
+    items, _ = parse_feedback(feedback)
+    lines = parse_chunk(chunk)
+    kept = []
+    for item in items:
+        checked = check_item(item, lines)
+        if checked is None:
+            print(f"Dropped, as what it refers to isn't there: L{item.line}")
+        elif checked.line != item.line:
+            print(f"L{item.line} is probably about L{checked.line}")
+        if checked is not None:
+            kept.append(checked)
+    return kept, lines
+
+
+def batch_feedback(
+    chunks,
+    backend,
+    model,
+    thesis_topic,
+    report,
+    mode="default",
+    response_tokens=RESPONSE_TOKENS,
+    concurrency=4,
+    cache=None,
+    refresh=False,
+    filter_feedback=False,
+):
+    """Review `chunks` without prompting, sending up to `concurrency` at once,
+    and write the feedback to `report` in document order.
 
-    generate_feedback(
-        fname,
+    Chunks reviewed before, with the same settings, are taken from `cache`
+    rather than sent again, unless `refresh` is set.
+    Comments that don't hold up against the text are dropped, and with
+    `filter_feedback` the rest go through a second, filtering, prompt.
+    """
+    keys = [review_key(text, model, thesis_topic, mode) for text in chunks]
+    requests = {
+        key: mode_text(review_prompt(text, thesis_topic), [], mode)
+        for key, text in zip(keys, chunks)
+    }
+    results = complete_cached(
+        backend,
         model,
-        thesis_topic,
-        recurse_subfiles=recurse_subfiles,
-        fname_stack=fname_stack,
-        start_line=final_line - 1,
-        messages=[],
-        total_cost=total_cost,
-        mode=mode,
+        requests,
+        response_tokens,
+        concurrency,
+        cache,
+        refresh,
+        action="Reviewing",
     )
 
+    chunk_items, chunk_lines, other = [], [], []
+    dropped = 0
+    for key, text in zip(keys, chunks):
+        items, chunk_other = parse_feedback(results[key]["feedback"])
+        lines = parse_chunk(text)
+        items, invalid = validate_feedback(items, lines)
+        dropped += len(invalid)
+        chunk_items.append(items)
+        chunk_lines.append(lines)
+        other.extend(chunk_other)
+    if dropped:
+        print(f"Dropped {dropped} comments about text that isn't there")
+    if filter_feedback:
+        chunk_items = post_process(
+            backend, chunk_items, chunk_lines, model, concurrency, cache, refresh
+        )
+
+    # overlapping requests can comment on the same lines
+    items = [item for items in chunk_items for item in items]
+    with open(report, "w") as f:
+        f.write(format_feedback(merge_feedback(items)) + "\n")
+        if other:
+            other = "\n".join(dict.fromkeys(other))  # drop repeats, keep order
+            f.write(f"\n## Other comments\n\n{other}\n")
+    print(f"Wrote {report}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Get feedback on a LaTeX file")
@@ -305,12 +639,13 @@ if __name__ == "__main__":
         help="The topic of the work being reviewed",
     )
     parser.add_argument(
-        "--model", type=str, default="gpt-3.5-turbo-0301", help="Model backend to use"
+        "--model", type=str, default=DEFAULT_MODEL, help="Model backend to use"
     )
     parser.add_argument(
         "--recurse_subfiles",
         action="store_true",
-        help="Read additional TeX files included using \input",
+        help="Read additional TeX files, included using \\input, \\include, "
+        + "\\subfile or \\import",
     )
     parser.add_argument(
         "--first_line",
@@ -324,24 +659,152 @@ if __name__ == "__main__":
         choices=["default", "harsh", "bam-up"],
         help="Style of critique to be used",
     )
-    # parser.add_argument(
-    #     "--post_process",
-    #     action="store_true",
-    #     help="Pass the review through an additional prompt to improve its quality",
-    # )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Review the whole document without prompting, and write a report",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of requests sent at once in --batch mode",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="review.md",
+        help="File the --batch mode feedback is written to",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=WINDOW_OVERLAP,
+        help="Tokens of context repeated between consecutive requests",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        default=None,
+        help="Only review what changed since this git ref, implies --batch",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Review every chunk again, rather than reusing cached reviews",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=CACHE_MAX_ENTRIES,
+        help="Maximum number of reviews to keep cached",
+    )
+    parser.add_argument(
+        "--context_fill",
+        type=float,
+        default=CONTEXT_FILL,
+        help="Fraction of the model's context window to fill with each request",
+    )
+    parser.add_argument(
+        "--response_tokens",
+        type=int,
+        default=RESPONSE_TOKENS,
+        help="Tokens reserved for the model's reply to each request",
+    )
+    parser.add_argument(
+        "--reduce",
+        type=str,
+        default=None,
+        help="Comma separated rules for leaving out text that isn't prose, "
+        + f"from {', '.join(RULES)} (default: all), or `none`",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Carry on with the last unfinished review of this file, "
+        + "without re-sending the parts already reviewed",
+    )
+    parser.add_argument(
+        "--query_tokens",
+        type=int,
+        default=QUERY_TOKENS,
+        help="Maximum tokens sent with each follow-up query about a review",
+    )
+    add_backend_arguments(parser)
+    parser.add_argument(
+        "--post_process",
+        action="store_true",
+        help="Pass the review through an additional prompt to improve its quality",
+    )
     args = parser.parse_args()
+    try:
+        reduce_rules = parse_rules(args.reduce)
+        if args.since:
+            repository(args.tex_file, args.since)
+    except ValueError as e:
+        parser.error(str(e))
 
     if args.model == "gpt-3.5-turbo-0301" and args.mode == "bam-up":
         warnings.warn("This model may refuse to insult you, consider another model")
 
-    fname_stack = [(args.tex_file, args.first_line)]
-    generate_feedback(
-        args.tex_file,
+    max_tokens = text_budget(
         args.model,
         args.thesis_topic,
-        args.recurse_subfiles,
-        fname_stack,
-        start_line=args.first_line,
-        mode=args.mode,
+        args.mode,
+        args.context_fill,
+        args.response_tokens,
     )
+    backend = open_backend(args, "reviewer_2")
+    try:
+        with open_cache(args.cache_size) as cache, open_sessions() as sessions:
+            if args.since:
+                chunks = diff_chunks(
+                    args.tex_file, args.since, args.model, max_tokens, reduce_rules
+                )
+            else:
+                chunks = split_document(
+                    args.tex_file,
+                    args.model,
+                    args.recurse_subfiles,
+                    args.first_line,
+                    max_tokens,
+                    args.overlap,
+                    reduce_rules,
+                )
+            if not chunks:
+                print("Nothing to review")
+            elif args.since or args.batch:
+                batch_feedback(
+                    chunks,
+                    backend,
+                    args.model,
+                    args.thesis_topic,
+                    args.report,
+                    mode=args.mode,
+                    response_tokens=args.response_tokens,
+                    concurrency=args.concurrency,
+                    cache=cache,
+                    refresh=args.refresh,
+                    filter_feedback=args.post_process,
+                )
+            else:
+                generate_feedback(
+                    chunks,
+                    backend,
+                    args.model,
+                    args.thesis_topic,
+                    mode=args.mode,
+                    response_tokens=args.response_tokens,
+                    cache=cache,
+                    refresh=args.refresh,
+                    query_tokens=args.query_tokens,
+                    sessions=sessions,
+                    session=session_key(
+                        args.tex_file, args.model, args.thesis_topic, args.mode
+                    ),
+                    resume=args.resume,
+                    filter_feedback=args.post_process,
+                )
+    finally:  # also when the review is stopped early, e.g. with "n" or Ctrl-C
+        print(backend.telemetry.summary())
     print("Cheers!")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import json
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from bib_loader import cache_dir
+
+# USD per 1K (prompt, completion) tokens, see https://openai.com/pricing
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo-0301": (0.002, 0.002),
+    "gpt-3.5-turbo-0613": (0.0015, 0.002),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+# e.g. gpt-4-0613 or gpt-4o-2024-08-06, snapshots of gpt-4 and gpt-4o
+SNAPSHOT_PATTERN = re.compile(r"(.+)-(?:\d{4}|\d{4}-\d{2}-\d{2})")
+
+
+def price(model: str) -> Optional[Tuple[float, float]]:
+    """Prompt and completion prices of `model`, or None if they're unknown"""
+    if model in PRICES:
+        return PRICES[model]
+    match = SNAPSHOT_PATTERN.fullmatch(model)
+    if match:
+        return PRICES.get(match.group(1))
+    return None
+
+
+def estimate_cost(
+    model: str, prompt_tokens: int, completion_tokens: int
+) -> Optional[float]:
+    """Estimated cost of a request in USD, or None if the model's price is
+    unknown, e.g. for a locally hosted model"""
+    prices = price(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+
+def format_cost(usd: Optional[float]) -> str:
+    return "an unknown amount" if usd is None else f"around ${usd:.4f}"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """The `q`th percentile of `values`, by the nearest rank"""
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def default_log() -> str:
+    return os.path.join(cache_dir(), "requests.jsonl")
+
+
+class Telemetry:
+    """Tokens, timings and costs of the LLM requests made by `tool`, appended
+    to a JSONL log as each request finishes.
+
+    Safe to record to from several threads at once.
+    """
+
+    def __init__(self, tool: str, path: Optional[os.PathLike] = None):
+        self.tool = tool
+        self.path = path or default_log()
+        self.records: List[dict] = []
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        model: str,
+        started: float,
+        latency: float,
+        first_token: Optional[float] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        retries: int = 0,
+        error: Optional[str] = None,
+    ) -> dict:
+        """Log a request that began at the unix time `started` and took
+        `latency` seconds, `first_token` of which before the reply started"""
+        record = {
+            "tool": self.tool,
+            "model": model,
+            "started": started,
+            "latency": latency,
+            "first_token": first_token,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": retries,
+            "cost": estimate_cost(model, prompt_tokens, completion_tokens),
+            "error": error,
+        }
+        with self.lock:
+            self.records.append(record)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+    def summary(self) -> str:
+        """Totals, p50/p95 latencies and throughput of the requests so far"""
+        if not self.records:
+            return "No LLM requests made"
+        done = [r for r in self.records if r["error"] is None]
+        prompt_tokens = sum(r["prompt_tokens"] for r in done)
+        completion_tokens = sum(r["completion_tokens"] for r in done)
+        costs = [r["cost"] for r in done]
+        total_cost = None if None in costs else sum(costs)
+        wall = max(r["started"] + r["latency"] for r in self.records) - min(
+            r["started"] for r in self.records
+        )
+
+        lines = [
+            f"{len(done)} LLM requests, {len(self.records) - len(done)} failed, "
+            + f"{sum(r['retries'] for r in self.records)} retries",
+            f"{prompt_tokens} prompt + {completion_tokens} completion tokens, "
+            + format_cost(total_cost),
+        ]
+        if done:
+            latencies = [r["latency"] for r in done]
+            lines.append(
+                f"latency p50 {percentile(latencies, 50):.2f}s, "
+                + f"p95 {percentile(latencies, 95):.2f}s"
+            )
+            first_tokens = [r["first_token"] for r in done if r["first_token"]]
+            if first_tokens:
+                lines.append(
+                    f"time to first token p50 {percentile(first_tokens, 50):.2f}s, "
+                    + f"p95 {percentile(first_tokens, 95):.2f}s"
+                )
+        if wall > 0:
+            lines.append(
+                f"throughput {len(done) / wall * 60:.1f} requests/min, "
+                + f"{(prompt_tokens + completion_tokens) / wall:.0f} tokens/s"
+            )
+        lines.append(f"logged to {self.path}")
+        return "\n".join(lines)
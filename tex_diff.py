@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import re
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+from tex_project import TexProject
+
+HUNK_PATTERN = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+# how far a change is grown in each direction, looking for its paragraph
+MAX_CONTEXT_LINES = 20
+
+
+def git(cwd: os.PathLike, *args: str) -> Optional[str]:
+    """Output of a git command, or None if it failed"""
+    result = subprocess.run(
+        ["git", *args], cwd=cwd, capture_output=True, text=True, check=False
+    )
+    return result.stdout if result.returncode == 0 else None
+
+
+def repository(fname: os.PathLike, ref: str) -> str:
+    """The top of the git repository holding `fname`, raising ValueError if
+    there isn't one, or it doesn't have `ref`"""
+    fname = os.path.realpath(fname)
+    top = git(os.path.dirname(fname), "rev-parse", "--show-toplevel")
+    if top is None:
+        raise ValueError(f"{fname} is not in a git repository")
+    top = top.strip()
+    if git(top, "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}") is None:
+        raise ValueError(f"Unknown git ref `{ref}`")
+    return top
+
+
+def changed_lines(fname: os.PathLike, ref: str) -> Optional[Set[int]]:
+    """Line numbers of `fname` changed since `ref`, or None if the file is
+    new since then"""
+    top = repository(fname, ref)
+    path = os.path.relpath(os.path.realpath(fname), top)
+    if git(top, "cat-file", "-e", f"{ref}:{path}") is None:
+        return None
+
+    diff = git(
+        top, "diff", "--unified=0", "--no-color", "--no-ext-diff", ref, "--", path
+    )
+    lines = set()
+    for match in HUNK_PATTERN.finditer(diff or ""):
+        start = int(match.group(1))
+        count = 1 if match.group(2) is None else int(match.group(2))
+        if count == 0:
+            # lines were deleted after `start`, so look at either side
+            lines.update([start, start + 1])
+        else:
+            lines.update(range(start, start + count))
+    return lines
+
+
+def expand_to_paragraphs(
+    lines: List[str], changed: Set[int], max_context: int = MAX_CONTEXT_LINES
+) -> List[Tuple[int, int]]:
+    """Grow each changed line to the paragraph around it, merging regions that
+    touch. Returns `(first, last)` line numbers, counting from 1.
+    Blank lines aren't grown, e.g. a new paragraph's blank line before it
+    would otherwise grow into the paragraph before that."""
+    regions = []
+    changed = (n for n in changed if 1 <= n <= len(lines) and lines[n - 1].strip())
+    for line_no in sorted(changed):
+        if regions and line_no <= regions[-1][1]:
+            continue  # already covered
+        first = line_no
+        while first > 1 and lines[first - 2].strip() and line_no - first < max_context:
+            first -= 1
+        last = line_no
+        while (
+            last < len(lines) and lines[last].strip() and last - line_no < max_context
+        ):
+            last += 1
+        if regions and first <= regions[-1][1] + 1:
+            regions[-1] = (regions[-1][0], last)
+        else:
+            regions.append((first, last))
+    return regions
+
+
+def changed_regions(fname: os.PathLike, ref: str) -> Dict[str, List[Tuple[int, int]]]:
+    """The regions of `fname`, and the files it includes, changed since
+    `ref`, grown to whole paragraphs"""
+    regions = {}
+    project = TexProject(fname)
+    for path in project.files:
+        lines = project.contents[path]
+        changed = changed_lines(path, ref)
+        if changed is None:
+            changed = set(range(1, len(lines) + 1))
+        if changed:
+            regions[path] = expand_to_paragraphs(lines, changed)
+    return regions
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import os
+import re
+import warnings
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+# \input{file}, \include{file} and \subfile{file}, relative to the project,
+# or to the directory given to \import{dir}{file} and friends
+INCLUDE_PATTERN = re.compile(
+    r"\\(?P<command>input|include|subfile)\s*\{(?P<file>[^}]+)\}"
+    + r"|\\(?P<import>(?:sub)?(?:import|inputfrom|includefrom))\s*"
+    + r"\{(?P<directory>[^}]*)\}\s*\{(?P<imported>[^}]+)\}"
+)
+COMMENT_PATTERN = re.compile(r"(?<!\\)%.*")
+
+
+class SourceLine(NamedTuple):
+    file: str  # relative to the directory of the root file
+    line: int  # counting from 1
+    text: str
+
+
+class TexProject:
+    """A LaTeX document spread across files, read once as a flat sequence of
+    lines in document order.
+
+    Each line keeps the file and line number it came from.
+    Lines that include another file are replaced by that file's lines,
+    with any text around the command kept as lines of their own.
+    Set `follow_includes` to False to only read the root file, and
+    `start_line` to skip that many lines of it, along with what they include.
+    """
+
+    def __init__(
+        self,
+        root_file: os.PathLike,
+        follow_includes: bool = True,
+        start_line: int = 0,
+    ):
+        self.root_file = os.path.abspath(root_file)
+        self.root_dir = os.path.dirname(self.root_file)
+        self.follow_includes = follow_includes
+        self.start_line = start_line
+        self.contents: Dict[str, List[str]] = {}  # each file, read once
+        self.children: Dict[str, List[str]] = defaultdict(list)
+        self.lines: List[SourceLine] = []
+        self.load(self.root_file, self.root_dir, [])
+
+    @property
+    def files(self) -> List[str]:
+        """Absolute paths of the files in the project, in the order first used"""
+        return list(self.contents)
+
+    def name(self, path: str) -> str:
+        return os.path.relpath(path, self.root_dir)
+
+    def read(self, path: str) -> Optional[List[str]]:
+        if path not in self.contents:
+            try:
+                with open(path, "r") as f:
+                    self.contents[path] = f.readlines()
+            except OSError:
+                return None
+        return self.contents[path]
+
+    def resolve(self, name: str, base_dir: str) -> str:
+        path = os.path.normpath(os.path.join(base_dir, name.strip()))
+        if not os.path.exists(path) and not path.endswith(".tex"):
+            path += ".tex"
+        return path
+
+    def load(self, path: str, base_dir: str, stack: List[str]):
+        """Append the lines of `path` to `lines`, with `base_dir` being where
+        the files it includes are looked for"""
+        if path in stack:
+            cycle = " -> ".join(self.name(p) for p in stack + [path])
+            raise ValueError(f"Files include each other in a cycle: {cycle}")
+        lines = self.read(path)
+        if lines is None:
+            warnings.warn(f"Can't read {self.name(path)}, skipping it")
+            return
+        stack = stack + [path]
+        name = self.name(path)
+
+        for line_no, line in enumerate(lines, 1):
+            if path == self.root_file and line_no <= self.start_line:
+                continue
+            if not self.follow_includes or "\\" not in line:
+                self.lines.append(SourceLine(name, line_no, line))
+                continue
+            code = COMMENT_PATTERN.sub("", line)
+            position = 0
+            for match in INCLUDE_PATTERN.finditer(code):
+                before = code[position : match.start()]
+                if before.strip():
+                    self.lines.append(SourceLine(name, line_no, before + "\n"))
+                position = match.end()
+
+                if match.group("command"):
+                    included = self.resolve(match.group("file"), base_dir)
+                    included_dir = base_dir
+                else:
+                    directory = match.group("directory")
+                    if match.group("import").startswith("sub"):
+                        # relative to the file doing the importing
+                        directory = os.path.join(os.path.dirname(path), directory)
+                    included_dir = os.path.join(self.root_dir, directory)
+                    included = self.resolve(match.group("imported"), included_dir)
+                self.children[path].append(included)
+                self.load(included, included_dir, stack)
+
+            if position == 0:
+                self.lines.append(SourceLine(name, line_no, line))
+            elif code[position:].strip():
+                self.lines.append(SourceLine(name, line_no, code[position:]))
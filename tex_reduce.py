@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from tex_project import COMMENT_PATTERN, SourceLine
+
+# environments that hold no prose, replaced by a placeholder, keeping captions
+FLOAT_ENVIRONMENTS = {
+    "figure",
+    "figure*",
+    "table",
+    "table*",
+    "wrapfigure",
+    "subfigure",
+    "tikzpicture",
+    "tabular",
+    "tabular*",
+    "tabularx",
+    "algorithm",
+    "algorithmic",
+    "lstlisting",
+    "minted",
+    "verbatim",
+}
+MATH_ENVIRONMENTS = {
+    "equation",
+    "equation*",
+    "align",
+    "align*",
+    "alignat",
+    "alignat*",
+    "gather",
+    "gather*",
+    "multline",
+    "multline*",
+    "flalign",
+    "flalign*",
+    "eqnarray",
+    "eqnarray*",
+    "displaymath",
+}
+# \[ and \] delimit displayed maths, but \\[2pt] is a line break
+ENVIRONMENT_PATTERN = re.compile(r"\\(begin|end)\s*\{([^}]+)\}|(?<!\\)\\(\[|\])")
+LABEL_PATTERN = re.compile(r"\\label\s*\{[^}]*\}")
+# references and citations keep their command, so the reviewer knows they
+# are there, but not their keys
+REF_PATTERN = re.compile(
+    r"\\((?:[cC]|auto|eq|page|name|v)?ref|(?:[a-zA-Z]*cite[a-zA-Z]*)\*?)"
+    + r"(\s*\[[^\]]*\])*\s*\{[^}]*\}"
+)
+
+Rule = Callable[[List[SourceLine]], List[SourceLine]]
+RULES: Dict[str, Rule] = {}
+
+
+def register_rule(name: str):
+    def register(rule: Rule) -> Rule:
+        RULES[name] = rule
+        return rule
+
+    return register
+
+
+def replace_text(source_line: SourceLine, text: str) -> Optional[SourceLine]:
+    """`source_line` with new text, or None if nothing is left of it"""
+    if not text.strip():
+        return None
+    if not text.endswith("\n"):
+        text += "\n"
+    return source_line._replace(text=text)
+
+
+@register_rule("comments")
+def strip_comments(lines: List[SourceLine]) -> List[SourceLine]:
+    """Drop comments at the end of lines"""
+    reduced = []
+    for source_line in lines:
+        if "%" in source_line.text and source_line.text.strip():
+            source_line = replace_text(
+                source_line, COMMENT_PATTERN.sub("", source_line.text)
+            )
+            if source_line is None:
+                continue
+        reduced.append(source_line)
+    return reduced
+
+
+@register_rule("preamble")
+def strip_preamble(lines: List[SourceLine]) -> List[SourceLine]:
+    """Drop everything outside of the document environment, if it's there"""
+    start = end = None
+    for i, source_line in enumerate(lines):
+        if start is None and "\\begin{document}" in source_line.text:
+            start = i
+        elif start is not None and "\\end{document}" in source_line.text:
+            end = i
+            break
+    if start is None:
+        return lines
+    return lines[start + 1 : end]
+
+
+def take_captions(text: str, depth: int = 0) -> Tuple[List[str], int]:
+    """The `\\caption`s in `text`, and how many of the last one's braces
+    are still open. With `depth > 0`, `text` starts inside a caption."""
+    captions = []
+    start = 0 if depth > 0 else text.find("\\caption")
+    while start != -1:
+        end, opened = start, depth > 0
+        while end < len(text) and not (opened and depth == 0):
+            if text[end] == "{":
+                depth, opened = depth + 1, True
+            elif text[end] == "}":
+                depth -= 1
+            end += 1
+        captions.append(text[start:end])
+        start = text.find("\\caption", end)
+    return captions, max(depth, 0)
+
+
+def elide_environments(
+    lines: List[SourceLine], environments: Iterable[str], label: Callable[[str], str]
+) -> List[SourceLine]:
+    """Replace each of `environments` with a placeholder on its first line,
+    keeping any text around it, and the text of its `\\caption`"""
+    reduced = []
+    inside = None  # the environment being elided, and how deeply it's nested
+    depth = 0
+    caption_depth = 0  # unclosed braces of a caption being kept
+    for source_line in lines:
+        text = source_line.text
+        kept = []
+        position = 0  # the start of the text to keep after an environment
+        elided = 0  # the start of the text being elided
+        for match in ENVIRONMENT_PATTERN.finditer(text):
+            begin = match.group(1) == "begin" or match.group(3) == "["
+            name = match.group(2) or "\\["
+            if inside is None:
+                if begin and name in environments:
+                    kept.append(text[position : match.start()])
+                    kept.append(label(name))
+                    inside, depth = name, 1
+                    elided = match.end()
+            elif name == inside or (inside == "\\[" and match.group(3)):
+                depth += 1 if begin else -1
+                if depth == 0:
+                    captions, _ = take_captions(
+                        text[elided : match.start()], caption_depth
+                    )
+                    kept.extend(" " + caption.strip() for caption in captions)
+                    inside, caption_depth = None, 0
+                    position = match.end()
+        if inside is None:
+            kept.append(text[position:])
+        else:
+            captions, caption_depth = take_captions(text[elided:], caption_depth)
+            kept.extend(" " + caption.strip() for caption in captions)
+
+        if "".join(kept) != text:
+            source_line = replace_text(source_line, "".join(kept))
+        if source_line is not None:
+            reduced.append(source_line)
+    return reduced
+
+
+@register_rule("floats")
+def elide_floats(lines: List[SourceLine]) -> List[SourceLine]:
+    """Replace figures, tables, TikZ, algorithms and code with a placeholder"""
+    return elide_environments(
+        lines, FLOAT_ENVIRONMENTS, lambda name: f"[{name.rstrip('*')} omitted]"
+    )
+
+
+@register_rule("math")
+def elide_math(lines: List[SourceLine]) -> List[SourceLine]:
+    """Replace displayed maths with a placeholder, leaving inline maths"""
+    return elide_environments(
+        lines, MATH_ENVIRONMENTS | {"\\["}, lambda name: "[equation omitted]"
+    )
+
+
+@register_rule("refs")
+def compress_refs(lines: List[SourceLine]) -> List[SourceLine]:
+    """Drop labels, and the keys of references and citations"""
+    reduced = []
+    for source_line in lines:
+        if "\\" in source_line.text:
+            text = LABEL_PATTERN.sub("", source_line.text)
+            text = REF_PATTERN.sub(lambda m: f"\\{m.group(1)}{{...}}", text)
+            if text.strip() == "" and source_line.text.strip() != "":
+                continue  # e.g. a line with only a label
+            source_line = source_line._replace(text=text)
+        reduced.append(source_line)
+    return reduced
+
+
+def parse_rules(names: Optional[str]) -> List[str]:
+    """Rule names from a comma separated list, all of them by default, or
+    none for "none" """
+    if names is None:
+        return list(RULES)
+    if names == "none":
+        return []
+    names = [name.strip() for name in names.split(",")]
+    unknown = [name for name in names if name not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown rules {unknown}, choose from {list(RULES)}")
+    return names
+
+
+def reduce_lines(lines: List[SourceLine], rules: Iterable[str]) -> List[SourceLine]:
+    """`lines` without the text that isn't prose worth reviewing, as picked
+    by `rules`. Lines keep the file and line number they came from."""
+    for name in RULES:
+        if name in rules:
+            lines = RULES[name](lines)
+    return lines
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import re
+import math
+import warnings
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# tokens each model can attend to, prompt and response combined
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo-0301": 4096,
+    "gpt-3.5-turbo-0613": 4096,
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# how much of the context window to plan on using, leaving some slack for
+# the token counts being estimates
+CONTEXT_FILL = 0.9
+# room left for the model's reply
+RESPONSE_TOKENS = 1024
+# chat formatting added around each message
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# rough BPE behaviour: words split into pieces of a few characters, numbers
+# into groups of up to three digits, and most symbols are tokens of their own
+FALLBACK_PATTERN = re.compile(r"[^\W\d_]+|\d+|\n+|[^\S\n]+|.")
+
+
+def context_window(model: str) -> int:
+    if model in CONTEXT_WINDOWS:
+        return CONTEXT_WINDOWS[model]
+    # e.g. gpt-4-0613 is a snapshot of gpt-4
+    prefixes = [name for name in CONTEXT_WINDOWS if model.startswith(name)]
+    if prefixes:
+        return CONTEXT_WINDOWS[max(prefixes, key=len)]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """The tiktoken encoding for `model`, or None to fall back to estimates"""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # e.g. the encoding can't be downloaded offline
+        warnings.warn(
+            f"Couldn't load a tokenizer for {model} ({type(e).__name__}), "
+            + "estimating token counts"
+        )
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Pure Python approximation of a BPE token count, erring high"""
+    tokens = 0
+    for piece in FALLBACK_PATTERN.findall(text):
+        if piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 6)
+        elif piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif piece[0] != " " or len(piece) > 1:
+            tokens += 1  # single spaces merge into the next word
+    return tokens
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Tokens used by a chat prompt, including the message formatting"""
+    return TOKENS_PER_REPLY + sum(
+        TOKENS_PER_MESSAGE + count_tokens(message["content"], model)
+        for message in messages
+    )
+
+
+def chunk_budget(
+    model: str,
+    prompt_tokens: int,
+    fill: float = CONTEXT_FILL,
+    response_tokens: int = RESPONSE_TOKENS,
+) -> int:
+    """Tokens of text that can go in one request, alongside a prompt of
+    `prompt_tokens` and a reply of up to `response_tokens`"""
+    budget = int(context_window(model) * fill) - prompt_tokens - response_tokens
+    if budget <= 0:
+        raise ValueError(
+            f"No room for text in {model}'s context window of "
+            + f"{context_window(model)} tokens, reduce the response tokens"
+        )
+    return budget
+
+
+def pack(
+    counts: Sequence[int], budget: int, start: int = 0
+) -> Iterator[Tuple[int, int]]:
+    """Split items, with token counts `counts`, into consecutive `(start, stop)`
+    ranges that each fit within `budget`.
+
+    Ranges are filled greedily, which gives the fewest ranges for items that
+    must stay in order.
+    An item larger than the budget gets a range of its own.
+    """
+    tokens = 0
+    for i in range(start, len(counts)):
+        if tokens + counts[i] > budget and i > start:
+            yield start, i
+            start, tokens = i, 0
+        tokens += counts[i]
+    if start < len(counts):
+        yield start, len(counts)
+
+
+def windows(
+    counts: Sequence[int],
+    budget: int,
+    overlap: int,
+    breaks: Sequence[int] = (),
+    start: int = 0,
+) -> Iterator[Tuple[int, int]]:
+    """Like `pack`, but each range after the first also repeats up to
+    `overlap` tokens from the end of the one before, so text across a
+    boundary is seen whole at least once.
+
+    `breaks` are the items that start a paragraph: a range starts at the
+    latest break within the overlap if there is one, so the overlap covers
+    the paragraph split by the boundary and nothing more (and nothing at all
+    if the boundary falls between paragraphs).
+    """
+    breaks = sorted(breaks)
+    while start < len(counts):
+        stop, tokens = start, 0
+        while stop < len(counts) and (tokens + counts[stop] <= budget or stop == start):
+            tokens += counts[stop]
+            stop += 1
+        yield start, stop
+        if stop == len(counts):
+            return
+
+        # step back from the boundary while the overlap fits in `overlap`
+        next_start, tokens = stop, 0
+        while next_start > start + 1 and tokens + counts[next_start - 1] <= overlap:
+            next_start -= 1
+            tokens += counts[next_start]
+        i = bisect_right(breaks, stop) - 1
+        if i >= 0 and breaks[i] >= next_start:
+            next_start = breaks[i]
+        start = next_start
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+from collections import defaultdict
+from typing import Dict, Iterable
+from bib_loader import entry_hash
+
+VERIFIED_PATH = "verified.jsonl"
+
+# key lists from before the store, one citekey per line
+LEGACY_PATHS = {
+    "arxiv": "verified_arxiv.txt",
+    "capitals": "verified_capital.txt",
+}
+
+
+class VerificationStore:
+    """Entries that have been manually checked, so a check shouldn't flag them.
+
+    Verifications are appended to a JSON lines log, and recorded per check
+    against the entry's content hash: once an entry is edited its
+    verification no longer applies, and the entry is checked again.
+    Keys from the old `verified_*.txt` lists apply whatever the contents.
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike = VERIFIED_PATH,
+        legacy_paths: Dict[str, os.PathLike] = LEGACY_PATHS,
+    ):
+        self.path = path
+        # check -> citekey -> content hash, or None to match any content
+        self.verified = defaultdict(dict)
+        for check, legacy_path in legacy_paths.items():
+            for key in load_key_list(legacy_path):
+                self.verified[check][key] = None
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.verified[record["check"]][record["key"]] = record["hash"]
+
+    def is_verified(self, check: str, entry: dict) -> bool:
+        verified = self.verified.get(check, {})
+        if entry["ID"] not in verified:
+            return False
+        content_hash = verified[entry["ID"]]
+        return content_hash is None or content_hash == entry_hash(entry)
+
+    def is_stale(self, check: str, entry: dict) -> bool:
+        """Whether the entry was verified, but has changed since"""
+        return entry["ID"] in self.verified.get(check, {}) and not self.is_verified(
+            check, entry
+        )
+
+    def add(self, check: str, entries: Iterable[dict]):
+        """Record the entries, as they are now, as verified for `check`"""
+        records = [
+            {"check": check, "key": entry["ID"], "hash": entry_hash(entry)}
+            for entry in entries
+        ]
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                self.verified[check][record["key"]] = record["hash"]
+
+    def fingerprint(self, check: str) -> str:
+        """Changes whenever the verifications for `check` do"""
+        verified = sorted(self.verified.get(check, {}).items(), key=str)
+        return hashlib.sha256(json.dumps(verified).encode()).hexdigest()
+
+
+def load_key_list(path: os.PathLike):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+POLL_INTERVAL = 0.5
+# editors and reference managers often write a file in several steps
+DEBOUNCE = 0.05
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+def load_inotify():
+    """libc's inotify functions, or None where they aren't available"""
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class Watcher:
+    """Waits for files to change.
+
+    `paths` are files, or directories standing for every `.tex` file below
+    them.
+    On Linux this uses inotify, watching the containing directories so that
+    files replaced by a rename (as Zotero's auto-export does) are still seen.
+    Elsewhere it polls modification times every `POLL_INTERVAL` seconds.
+    """
+
+    def __init__(self, paths: Iterable[os.PathLike]):
+        self.files = set()
+        self.trees = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            (self.trees if os.path.isdir(path) else self.files).add(path)
+
+        self.fd = None
+        libc = load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                self.directories = {}
+                for directory in self.watched_directories():
+                    wd = libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK)
+                    if wd >= 0:
+                        self.directories[wd] = directory
+        if self.fd is None:
+            self.mtimes = self.stat_all()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def watched_directories(self) -> Set[str]:
+        directories = {os.path.dirname(path) for path in self.files}
+        for tree in self.trees:
+            directories.update(root for root, _, _ in os.walk(tree))
+        return directories
+
+    def is_watched(self, path: str) -> bool:
+        if path in self.files:
+            return True
+        return path.endswith(".tex") and any(
+            path.startswith(tree + os.sep) for tree in self.trees
+        )
+
+    def stat_all(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        paths = set(self.files)
+        for tree in self.trees:
+            for root, _, names in os.walk(tree):
+                paths.update(os.path.join(root, n) for n in names if n.endswith(".tex"))
+        mtimes = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                mtimes[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                mtimes[path] = None  # e.g. midway through being replaced
+        return mtimes
+
+    def read_events(self, timeout: Optional[float]) -> Set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+            path = os.path.join(self.directories.get(wd, ""), name)
+            if self.is_watched(path):
+                changed.add(path)
+        return changed
+
+    def poll(self, timeout: Optional[float]) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtimes = self.stat_all()
+            changed = {
+                path
+                for path in mtimes.keys() | self.mtimes.keys()
+                if mtimes.get(path) != self.mtimes.get(path)
+            }
+            self.mtimes = mtimes
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(POLL_INTERVAL)
+
+    def wait(self) -> Set[str]:
+        """Block until a watched file changes, returning the changed paths"""
+        if self.fd is None:
+            changed = self.poll(None)
+            return changed | self.poll(DEBOUNCE)
+
+        changed = set()
+        while not changed:
+            changed = self.read_events(None)
+        while events := self.read_events(DEBOUNCE):
+            changed |= events
+        return changed